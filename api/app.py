@@ -8,9 +8,11 @@ from slowapi import Limiter
 from slowapi.errors import RateLimitExceeded
 from slowapi.middleware import SlowAPIMiddleware
 
+from . import images, passwords
 from .config import get_settings
-from .db import engine, get_db
+from .db import engine, get_db, mark_writer, read_engine
 from .exceptions import rate_limit_exceeded_handler
+from .models.image import StoredImage
 from .models.upload import UploadSession
 
 global_settings = get_settings()
@@ -39,17 +41,30 @@ app.add_exception_handler(RateLimitExceeded, rate_limit_exceeded_handler)
 app.add_middleware(SlowAPIMiddleware)
 
 
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    response = await call_next(request)
+    if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        mark_writer(request)
+    return response
+
+
 async def setup_media():
     async for session in get_db():
         await UploadSession.flush(session)
+        await StoredImage.recount(session)
+        await StoredImage.collect(session)
 
     rmtree(path.join(global_settings.media_path, "blobs"), ignore_errors=True)
+    rmtree(path.join(global_settings.media_path, "objects", "staging"), ignore_errors=True)
     makedirs(path.join(global_settings.media_path, "users"), exist_ok=True)
     makedirs(path.join(global_settings.media_path, "blobs"), exist_ok=True)
+    makedirs(path.join(global_settings.media_path, "objects"), exist_ok=True)
 
 
 async def stop_db():
     await engine.dispose()
+    await read_engine.dispose()
 
 
 @app.on_event("startup")
@@ -61,4 +76,6 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     log.info("Shutting down...")
+    images.shutdown_executor()
+    passwords.shutdown_executor()
     await stop_db()
@@ -0,0 +1,172 @@
+import os
+import struct
+import time
+import zlib
+from hashlib import sha1
+from typing import AsyncIterator, NamedTuple
+
+from aiofiles import open
+
+ARCHIVE_CHUNK_SIZE = 64 * 1024
+
+# Bit 3: the CRC is in the data descriptor after the file, bit 11: the names are in UTF-8
+ZIP_FLAGS = 0x0808
+ZIP_VERSION = 20
+
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+DATA_DESCRIPTOR = struct.Struct("<IIII")
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+END_OF_CENTRAL_DIRECTORY = struct.Struct("<IHHHHIIH")
+
+
+class ArchiveEntry(NamedTuple):
+    name: bytes
+    path: str
+    stat_result: os.stat_result
+
+    @property
+    def size(self):
+        return self.stat_result.st_size
+
+    @property
+    def dos_time(self):
+        """Modification time of the file, as the time and date used in zip headers."""
+        t = time.gmtime(max(self.stat_result.st_mtime, 315532800))
+        return t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2, (t.tm_year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday
+
+
+class StoredZip:
+    """Zip archive of files stored without compression, generated on the fly.
+    The CRCs are only needed after each file, so the size and the layout of the archive are known beforehand,
+    which allows any range of it to be generated without keeping more than a chunk in memory.
+    """
+
+    def __init__(self, files: list[tuple[str, str]]):
+        """:param files: Name in the archive and path of each file"""
+        self.entries = [ArchiveEntry(name.encode(), path, os.stat(path)) for name, path in files]
+        self.crcs: dict[int, int] = {}
+
+        offset = 0
+        self.parts = []
+        self.offsets = []
+        for i, entry in enumerate(self.entries):
+            self.offsets.append(offset)
+            self.parts.extend(
+                (
+                    (LOCAL_HEADER.size + len(entry.name), self._local_header, i),
+                    (entry.size, self._file_data, i),
+                    (DATA_DESCRIPTOR.size, self._data_descriptor, i),
+                )
+            )
+            offset += LOCAL_HEADER.size + len(entry.name) + entry.size + DATA_DESCRIPTOR.size
+
+        self.central_directory_offset = offset
+        self.central_directory_size = sum(CENTRAL_HEADER.size + len(entry.name) for entry in self.entries)
+        self.parts.append((self.central_directory_size + END_OF_CENTRAL_DIRECTORY.size, self._central_directory, None))
+        self.size = offset + self.central_directory_size + END_OF_CENTRAL_DIRECTORY.size
+
+    @property
+    def etag(self):
+        """Strong ETag of the archive, which changes with any of its files."""
+        digest = sha1()
+        for entry in self.entries:
+            stat_result = entry.stat_result
+            digest.update(
+                entry.name + f":{stat_result.st_ino}-{stat_result.st_size}-{stat_result.st_mtime_ns};".encode()
+            )
+        return f'"{digest.hexdigest()}"'
+
+    async def iter_range(self, start: int = 0, end: int = None) -> AsyncIterator[bytes]:
+        """Generates the bytes of the archive from start to end (excluded)."""
+        end = self.size if end is None else end
+        position = 0
+        for size, generate, index in self.parts:
+            if position >= end:
+                break
+            if position + size > start:
+                part_start = max(start - position, 0)
+                async for chunk in generate(index, part_start, min(end - position, size)):
+                    yield chunk
+            position += size
+
+    async def _local_header(self, index: int, start: int, end: int):
+        entry = self.entries[index]
+        dos_time, dos_date = entry.dos_time
+        header = LOCAL_HEADER.pack(
+            0x04034B50, ZIP_VERSION, ZIP_FLAGS, 0, dos_time, dos_date, 0, entry.size, entry.size, len(entry.name), 0
+        )
+        yield (header + entry.name)[start:end]
+
+    async def _file_data(self, index: int, start: int, end: int):
+        crc = 0
+        async with open(self.entries[index].path, "rb") as file:
+            await file.seek(start)
+            position = start
+            while position < end:
+                chunk = await file.read(min(ARCHIVE_CHUNK_SIZE, end - position))
+                if not chunk:
+                    raise RuntimeError(f"{self.entries[index].path} was truncated while being archived")
+                if start == 0:
+                    crc = zlib.crc32(chunk, crc)
+                position += len(chunk)
+                yield chunk
+        if start == 0 and end == self.entries[index].size:
+            self.crcs[index] = crc
+
+    async def _data_descriptor(self, index: int, start: int, end: int):
+        entry = self.entries[index]
+        descriptor = DATA_DESCRIPTOR.pack(0x08074B50, await self._crc(index), entry.size, entry.size)
+        yield descriptor[start:end]
+
+    async def _central_directory(self, _, start: int, end: int):
+        position = 0
+        for index, entry in enumerate(self.entries):
+            size = CENTRAL_HEADER.size + len(entry.name)
+            if start < position + size and position < end:
+                dos_time, dos_date = entry.dos_time
+                header = CENTRAL_HEADER.pack(
+                    0x02014B50,
+                    ZIP_VERSION,
+                    ZIP_VERSION,
+                    ZIP_FLAGS,
+                    0,
+                    dos_time,
+                    dos_date,
+                    await self._crc(index),
+                    entry.size,
+                    entry.size,
+                    len(entry.name),
+                    0,
+                    0,
+                    0,
+                    0,
+                    0,
+                    self.offsets[index],
+                )
+                first, last = max(start - position, 0), end - position
+                yield (header + entry.name)[first:last]
+            position += size
+
+        end_record = END_OF_CENTRAL_DIRECTORY.pack(
+            0x06054B50,
+            0,
+            0,
+            len(self.entries),
+            len(self.entries),
+            self.central_directory_size,
+            self.central_directory_offset,
+            0,
+        )
+        if end > position:
+            first, last = max(start - position, 0), end - position
+            yield end_record[first:last]
+
+    async def _crc(self, index: int) -> int:
+        # When the file wasn't fully sent in this request, it has to be read again
+        if index not in self.crcs:
+            crc = 0
+            async with open(self.entries[index].path, "rb") as file:
+                while chunk := await file.read(ARCHIVE_CHUNK_SIZE):
+                    crc = zlib.crc32(chunk, crc)
+            self.crcs[index] = crc
+        return self.crcs[index]
@@ -0,0 +1,80 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Protocol
+
+
+class TTLCache:
+    """In-memory cache whose entries expire after some time.
+    Once it's full, the least recently used entries are evicted first.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        """
+        :param ttl: seconds an entry stays valid for
+        :param maxsize: maximum amount of entries
+        """
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value, ttl: Optional[float] = None):
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CacheBackend(Protocol):
+    """Subset of the asyncio Redis client used by the caches shared between processes."""
+
+    async def get(self, name: str) -> Optional[bytes]:
+        ...
+
+    async def set(self, name: str, value: bytes, ex: Optional[int] = None):
+        ...
+
+    async def incr(self, name: str) -> int:
+        ...
+
+
+class MemoryBackend:
+    """Cache backend local to the process, the least recently used values are evicted once it's full.
+    The counters are kept apart, so they are never evicted.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60):
+        self.values = TTLCache(ttl, maxsize)
+        self.counters: dict[str, int] = {}
+
+    async def get(self, name: str) -> Optional[bytes]:
+        if name in self.counters:
+            return str(self.counters[name]).encode()
+        return self.values.get(name)
+
+    async def set(self, name: str, value: bytes, ex: Optional[int] = None):
+        self.counters.pop(name, None)
+        self.values.set(name, value, ex)
+
+    async def incr(self, name: str) -> int:
+        self.counters[name] = self.counters.get(name, 0) + 1
+        return self.counters[name]
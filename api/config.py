@@ -1,25 +1,69 @@
 import logging
 from functools import lru_cache
+from typing import List, Optional
 
-from pydantic import AnyUrl, BaseSettings, Field
+from pydantic import AnyUrl, BaseSettings, Field, conint, constr, validator
 
 log = logging.getLogger(__name__)
 
+ImageFormat = constr(regex="^(webp|avif)$")
+ImageWidth = conint(gt=0)
+# "none", "memory" or the "module:attribute" path of a factory creating the backend
+ResponseCache = constr(regex=r"^(none|memory|[\w.]+:[\w.]+)$")
+PaginationTotal = constr(regex="^(exact|estimated|cached|none)$")
+MediaDelivery = constr(regex="^(direct|x-accel-redirect|x-sendfile)$")
+
 
 class Settings(BaseSettings):
     db_url: AnyUrl
+    db_read_url: Optional[AnyUrl] = None
+    db_read_sticky_ttl: float = Field(5, gt=0)
+    db_read_sticky_size: int = Field(10_000, gt=0)
+    db_pool_size: int = Field(5, gt=0)
+    db_max_overflow: int = Field(10, ge=0)
+    db_pool_timeout: float = Field(30, gt=0)
+    db_pool_recycle: int = -1
+    db_pool_pre_ping: bool = False
+    db_statement_cache_size: int = Field(100, ge=0)
+    db_prepared_statement_cache_size: int = Field(100, ge=0)
+    db_pgbouncer: bool = False
     cors_origins: str = ""
 
     jwt_secret_key: str
     jwt_algorithm: str = "HS256"
     jwt_access_token_expire_minutes: int = 60
+    jwt_principal_claims: bool = False
+    password_hash_workers: int = Field(2, gt=0)
+    user_cache_ttl: float = Field(30, gt=0)
+    user_cache_size: int = Field(1024, gt=0)
 
     media_path: str = "/media"
     temp_path: str = "/tmp"
+    image_workers: Optional[int] = Field(None, gt=0)
+    image_variant_widths: List[ImageWidth] = [320, 720, 1440]
+    image_variant_formats: List[ImageFormat] = ["webp"]
+    media_delivery: MediaDelivery = "direct"
+    media_accel_prefix: str = "/internal-media"
 
+    groups_cache_ttl: float = Field(300, gt=0)
+    response_cache: ResponseCache = "memory"
+    response_cache_ttl: int = Field(30, gt=0)
+    response_cache_size: int = Field(1024, gt=0)
+    response_cache_url: Optional[str] = None
     max_page_limit: int = Field(50, gt=0)
+    pagination_total: PaginationTotal = "exact"
+    pagination_total_ttl: float = Field(60, gt=0)
     allow_registration: bool = False
 
+    @validator("image_variant_formats")
+    def check_encoders(cls, formats):
+        # Pillow is only able to encode AVIF images when it's built with libavif
+        from PIL import features
+
+        if "avif" in formats and not features.check("avif"):
+            raise ValueError("This build of Pillow can't encode AVIF images")
+        return formats
+
 
 @lru_cache
 def get_settings():
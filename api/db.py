@@ -1,22 +1,95 @@
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Optional
+from uuid import uuid4
 
+from asyncpg import Connection
+from fastapi import Request
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 from . import config
+from .cache import TTLCache
+from .fastapi_permissions import Authenticated
 
 global_settings = config.get_settings()
 
-engine = create_async_engine(
-    global_settings.db_url,
-    future=True,
-    # echo=True, # To debug SQL queries
-)
+
+class PgBouncerConnection(Connection):
+    """asyncpg connection whose prepared statements have unique names,
+    PgBouncer can give a server connection where a statement of the same name already exists.
+    """
+
+    def _get_unique_id(self, prefix: str) -> str:
+        return f"__asyncpg_{prefix}_{uuid4()}__"
+
+
+def make_engine(url: str) -> AsyncEngine:
+    """Creates an engine with the pool and the statement caches of the settings."""
+    if global_settings.db_pgbouncer:
+        connect_args = {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "connection_class": PgBouncerConnection,
+        }
+    else:
+        connect_args = {
+            "statement_cache_size": global_settings.db_statement_cache_size,
+            "prepared_statement_cache_size": global_settings.db_prepared_statement_cache_size,
+        }
+
+    return create_async_engine(
+        url,
+        future=True,
+        pool_size=global_settings.db_pool_size,
+        max_overflow=global_settings.db_max_overflow,
+        pool_timeout=global_settings.db_pool_timeout,
+        pool_recycle=global_settings.db_pool_recycle,
+        pool_pre_ping=global_settings.db_pool_pre_ping,
+        connect_args=connect_args,
+        # echo=True, # To debug SQL queries
+    )
+
+
+engine = make_engine(global_settings.db_url)
+read_engine = make_engine(global_settings.db_read_url) if global_settings.db_read_url else engine
 
 # expire_on_commit=False will prevent attributes from being expired
 # after commit.
 async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+read_session = (
+    sessionmaker(read_engine, expire_on_commit=False, class_=AsyncSession)
+    if read_engine is not engine
+    else async_session
+)
+
+# Clients that recently wrote something, their reads go to the primary until the replica caught up
+recent_writers = TTLCache(global_settings.db_read_sticky_ttl, global_settings.db_read_sticky_size)
+
+
+def has_replica() -> bool:
+    return read_session is not async_session
+
+
+def writer_key(request: Request) -> Optional[str]:
+    """Identifies the client of a request by its token, the anonymous clients can share an address behind a proxy."""
+    return request.headers.get("authorization")
+
+
+def mark_writer(request: Request):
+    """Sends the next reads of the client to the primary, if it's authenticated and wrote something.
+    The auth endpoints don't write anything the client reads afterwards.
+    """
+    key = writer_key(request)
+    if key is None or request.url.path.startswith("/auth"):
+        return
+    principals = getattr(request.state, "principals", None)
+    if (principals and Authenticated in principals) or getattr(request.state, "user", None):
+        recent_writers.set(key, True)
+
+
+def is_recent_writer(request: Request) -> bool:
+    key = writer_key(request)
+    return key is not None and bool(recent_writers.get(key))
 
 
 # Dependency
@@ -30,3 +103,15 @@ async def get_db() -> AsyncGenerator:
         raise ex
     finally:
         await session.close()
+
+
+async def get_read_db(request: Request) -> AsyncGenerator:
+    """Session on the read replica, or on the primary for the clients that just wrote, to read their own writes."""
+    if is_recent_writer(request):
+        session = async_session()
+    else:
+        session = read_session()
+    try:
+        yield session
+    finally:
+        await session.close()
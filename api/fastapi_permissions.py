@@ -6,10 +6,10 @@ Framework, so all cudos to them!
 
 __version__ = "0.2.7"
 
-from functools import partial
+from functools import partial, wraps
 from inspect import iscoroutinefunction
 from itertools import chain
-from typing import Any
+from typing import Any, Callable, Iterable, NamedTuple, Optional
 
 from fastapi import Depends, HTTPException, status
 
@@ -44,6 +44,120 @@ DENY_ALL = (Deny, Everyone, All)  # acl shorthand, denies anything
 ALOW_ALL = (Allow, Everyone, All)  # acl shorthand, allows everything
 
 
+class _Rules(NamedTuple):
+    """rules of an acl for a single permission
+    any_of: principals that are granted the permission on their own
+    all_of: sets of principals that are granted the permission together
+    ordered: (allowed, principals) in the order of the acl, only used if
+             some of the rules deny the permission, since the first match wins
+    """
+
+    any_of: frozenset
+    all_of: tuple
+    ordered: tuple
+
+
+def _normalize_entry(entry):
+    """returns an acl entry as (allowed, set of principals, permissions)"""
+    action, principals, permissions = entry
+    principals = frozenset([principals] if isinstance(principals, str) else principals)
+    if isinstance(permissions, str):
+        permissions = {permissions}
+    return action == Allow, principals, permissions
+
+
+class CompiledACL:
+    """access control list indexed by permission
+    The rules of a permission are compiled the first time it's checked,
+    so a check is a few set operations on the principals instead of a scan
+    of the whole acl. It can still be iterated like the acl it was built from.
+    """
+
+    def __init__(self, acl: Iterable):
+        self.acl = tuple(acl)
+        self.entries = [_normalize_entry(entry) for entry in self.acl]
+        self.index: dict[str, _Rules] = {}
+
+    def __iter__(self):
+        return iter(self.acl)
+
+    def rules(self, permission: str) -> _Rules:
+        rules = self.index.get(permission)
+        if rules is None:
+            matching = [(allowed, principals) for allowed, principals, perms in self.entries if permission in perms]
+            if all(allowed for allowed, _ in matching):
+                any_of = frozenset(next(iter(p)) for _, p in matching if len(p) == 1)
+                all_of = tuple(p for _, p in matching if len(p) != 1)
+                rules = _Rules(any_of, all_of, ())
+            else:
+                rules = _Rules(frozenset(), (), tuple(matching))
+            self.index[permission] = rules
+        return rules
+
+    def check(self, principals: frozenset, permission: str) -> Optional[bool]:
+        """returns if the permission is allowed or denied to the principals,
+        or None if no rule of the acl applies to them
+        """
+        any_of, all_of, ordered = self.index.get(permission) or self.rules(permission)
+        if ordered:
+            for allowed, required in ordered:
+                if principals.issuperset(required):
+                    return allowed
+            return None
+        if not any_of.isdisjoint(principals):
+            return True
+        for required in all_of:
+            if principals.issuperset(required):
+                return True
+        return None
+
+    def extend(self, row_acl: Callable[[], Iterable]) -> "RowACL":
+        """appends the entries of a single row to a class acl"""
+        return RowACL(self, row_acl)
+
+
+class RowACL:
+    """compiled class acl followed by the entries of a row
+    The entries of the row are only built if the class acl doesn't apply.
+    """
+
+    def __init__(self, class_acl: CompiledACL, row_acl: Callable[[], Iterable]):
+        self.class_acl = class_acl
+        self.row_acl = row_acl
+
+    def __iter__(self):
+        return chain(self.class_acl, self.row_acl())
+
+    def check(self, principals: frozenset, permission: str) -> Optional[bool]:
+        allowed = self.class_acl.check(principals, permission)
+        if allowed is not None:
+            return allowed
+        return self.check_row(principals, permission)
+
+    def check_row(self, principals: frozenset, permission: str) -> Optional[bool]:
+        """same as check, but only with the entries of the row"""
+        for action, required, permissions in self.row_acl():
+            if permission == permissions or (not isinstance(permissions, str) and permission in permissions):
+                if isinstance(required, str):
+                    required = (required,)
+                if principals.issuperset(required):
+                    return action == Allow
+        return None
+
+
+def compiled_acl(class_acl: Callable[[Any], Iterable]):
+    """decorator for the __class_acl__ of a model, it's compiled once per class"""
+    compiled = {}
+
+    @wraps(class_acl)
+    def wrapper(cls):
+        if cls not in compiled:
+            compiled[cls] = CompiledACL(class_acl(cls))
+        return compiled[cls]
+
+    return wrapper
+
+
 # the exception that will be raised, if no sufficient permissions are found
 # can be configured in the configure_permissions() function
 permission_exception = HTTPException(
@@ -121,7 +235,7 @@ def permission_dependency_factory(
     return Depends(permission_dependency)
 
 
-async def has_permission(user_principals: list, requested_permission: str, resource: Any):
+async def has_permission(user_principals: Iterable, requested_permission: str, resource: Any):
     """checks if a user has the permission for a resource
     The order of the function parameters can be remembered like "Joe eat apple"
     user_principals: the principals of a user
@@ -130,14 +244,42 @@ async def has_permission(user_principals: list, requested_permission: str, resou
     returns bool: permission granted or denied
     """
     acl = await normalize_acl(resource)
-
-    for action, principals, permissions in acl:
-        if isinstance(permissions, str):
-            permissions = {permissions}
-        if requested_permission in permissions:
-            if all(principal in user_principals for principal in principals):
-                return action == Allow
-    return False
+    if not isinstance(acl, (CompiledACL, RowACL)):
+        acl = CompiledACL(acl)
+    return acl.check(frozenset(user_principals), requested_permission) or False
+
+
+async def filter_permitted(user_principals: Iterable, requested_permission: str, rows: Iterable) -> list:
+    """returns the rows a user has the permission for, in the same order
+    The class acl shared by the rows is only checked once, the entries of
+    each row are only evaluated if it doesn't decide.
+    It's meant for the lists that aren't paginated, the paginated queries
+    must filter their rows with Base.permitted_clause instead, or their pages
+    would be short and their totals wrong.
+    user_principals: the principals of a user
+    requested_permission: the permission that should be checked
+    rows: the objects the user wants to access, must provide an ACL
+    returns list: the permitted rows
+    """
+    principals = frozenset(user_principals)
+    class_decisions = {}
+    permitted = []
+    for row in rows:
+        acl = await normalize_acl(row)
+        if isinstance(acl, RowACL):
+            key = id(acl.class_acl)
+            if key not in class_decisions:
+                class_decisions[key] = acl.class_acl.check(principals, requested_permission)
+            allowed = class_decisions[key]
+            if allowed is None:
+                allowed = acl.check_row(principals, requested_permission)
+        elif isinstance(acl, CompiledACL):
+            allowed = acl.check(principals, requested_permission)
+        else:
+            allowed = CompiledACL(acl).check(principals, requested_permission)
+        if allowed:
+            permitted.append(row)
+    return permitted
 
 
 async def list_permissions(user_principals: list, resource: Any):
@@ -0,0 +1,146 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from io import BytesIO
+from os import path, replace
+from typing import Optional, Union
+from uuid import uuid4
+from zipfile import ZipFile
+
+from PIL import Image
+
+from .config import get_settings
+from .storage import link_file, write_object
+
+global_settings = get_settings()
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+PIL_FORMATS = {"jpg": "JPEG", "webp": "WEBP", "avif": "AVIF"}
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """Returns the process pool used for image work, creating it on first use."""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=global_settings.image_workers)
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+
+
+async def run_in_worker(func, *args):
+    """Runs an image function in the process pool without blocking the event loop.
+    The function and its arguments need to be picklable.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), partial(func, *args))
+
+
+def convert_image(source: Union[str, bytes], destination: str):
+    """Decodes an image file (or its content) and saves it in RGB to the destination."""
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    with Image.open(source) as im:
+        _save_atomic(im.convert("RGB"), destination, "jpg")
+
+
+def variant_suffixes() -> list[str]:
+    """Suffixes of the variants saved next to each image, ex: 1.jpg -> 1.webp, 1.720.jpg, 1.720.webp..."""
+    formats = global_settings.image_variant_formats
+    suffixes = [f".{fmt}" for fmt in formats]
+    for width in global_settings.image_variant_widths:
+        suffixes.extend(f".{width}.{fmt}" for fmt in ("jpg", *formats))
+    return suffixes
+
+
+def save_variants(image_path: str, overwrite: bool = True):
+    """Saves the variants of a JPEG image next to it.
+    Without overwrite, the variants are only created if they don't exist yet.
+    """
+    stem, _ = path.splitext(image_path)
+    if not overwrite and all(path.exists(f"{stem}{suffix}") for suffix in variant_suffixes()):
+        return
+
+    formats = global_settings.image_variant_formats
+    with Image.open(image_path) as im:
+        for fmt in formats:
+            _save_atomic(im, f"{stem}.{fmt}", fmt)
+        for width in global_settings.image_variant_widths:
+            if im.width > width:
+                resized = im.resize((width, round(im.height * width / im.width)), Image.LANCZOS)
+                for fmt in ("jpg", *formats):
+                    _save_atomic(resized, f"{stem}.{width}.{fmt}", fmt)
+            else:
+                # The image isn't upscaled, its variants of that width are links to the full size ones
+                _link_atomic(image_path, f"{stem}.{width}.jpg")
+                for fmt in formats:
+                    _link_atomic(f"{stem}.{fmt}", f"{stem}.{width}.{fmt}")
+
+
+def _save_atomic(image: Image.Image, destination: str, fmt: str):
+    # Readers and hardlinks should never see a partially written image
+    temp_path = f"{destination}.{uuid4()}"
+    image.save(temp_path, PIL_FORMATS[fmt])
+    replace(temp_path, destination)
+
+
+def _link_atomic(source: str, destination: str):
+    temp_path = f"{destination}.{uuid4()}"
+    link_file(source, temp_path)
+    replace(temp_path, destination)
+
+
+def store_image(source: Union[str, bytes]) -> str:
+    """Decodes an image file (or its content), stages it in RGB and returns its staged path."""
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    with Image.open(source) as im:
+        return _store(im.convert("RGB"))
+
+
+def store_archive_member(archive: str, member: str) -> str:
+    """Stages a single image of a zip archive, without extracting the rest of it."""
+    with ZipFile(archive) as zip_file:
+        return store_image(zip_file.read(member))
+
+
+def concat_and_cut_images(sources: list[str]) -> list[str]:
+    """Joins the images vertically and cuts the result in parts with a 1:2 ratio.
+    The parts are staged and their staged paths returned in order.
+    """
+    images = [Image.open(source) for source in sources]
+    height = sum(image.height for image in images)
+
+    if not all(images[0].width == image.width for image in images):
+        for image in images:
+            image.close()
+        raise ValueError("All the images should have the same width")
+
+    joined = Image.new("RGB", (images[0].width, height))
+    running_height = 0
+    for image in images:
+        joined.paste(image, (0, running_height))
+        image.close()
+        running_height += image.height
+
+    amount_parts = joined.height // (2 * joined.width) + 1
+    parts = []
+    for i in range(amount_parts):
+        end_y = min(height, 2 * joined.width * (i + 1))
+        part = joined.crop((0, 2 * joined.width * i, joined.width, end_y))
+        parts.append(_store(part))
+        part.close()
+
+    return parts
+
+
+def _store(image: Image.Image) -> str:
+    content = BytesIO()
+    image.save(content, "JPEG")
+    return write_object(content.getvalue())
@@ -1,10 +1,10 @@
 from fastapi import Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import RedirectResponse
-from fastapi.staticfiles import StaticFiles
 
 from .app import app
 from .config import get_settings
+from .media import MediaFiles
 from .routers import auth, autocomplete, chapter, comment, manga, settings, upload, user
 
 global_settings = get_settings()
@@ -18,7 +18,7 @@ app.include_router(settings.router)
 app.include_router(upload.router)
 app.include_router(user.router)
 
-app.mount("/media", StaticFiles(directory=global_settings.media_path), name="media")
+app.mount("/media", MediaFiles(directory=global_settings.media_path), name="media")
 
 origins = global_settings.cors_origins.split(",")
 
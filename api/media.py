@@ -0,0 +1,255 @@
+import os
+import re
+from typing import Optional
+from urllib.parse import parse_qs, quote
+
+import aiofiles
+from fastapi import Request
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response, StreamingResponse
+from starlette.staticfiles import NotModifiedResponse
+from starlette.types import Receive, Scope, Send
+
+from .archive import StoredZip
+from .config import get_settings
+from .exceptions import NotFoundHTTPException
+from .storage import get_object_path
+
+global_settings = get_settings()
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
+# Those folders only contain files that are never modified once created
+IMMUTABLE_FOLDERS = ("objects", "blobs")
+
+DIGEST = re.compile(r"[0-9a-f]{64}")
+
+
+def get_version(stat_result: os.stat_result) -> str:
+    """Version of a media file, used by its ETag.
+    Stored images are shared by inode and never modified, other images are always replaced by a new file.
+    """
+    return f"{stat_result.st_ino:x}-{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"
+
+
+def get_etag(stat_result: os.stat_result):
+    """Strong ETag of a media file."""
+    return f'"{get_version(stat_result)}"'
+
+
+def is_current_version(full_path: str, stat_result: os.stat_result, version: str) -> bool:
+    """Checks the version given in the query of a request against the requested image.
+    The pages are versioned with the hash of their content, the file must then be a link to that stored object.
+    The other images are versioned with their JPEG image, ex: cover.jpg for cover.320.webp,
+    the variants being saved after it.
+    """
+    folder, name = os.path.split(full_path)
+    stem, _, extensions = name.partition(".")
+    if DIGEST.fullmatch(version):
+        try:
+            object_stat = os.stat(get_object_path(version, f".{extensions}"))
+        except FileNotFoundError:
+            return False
+        return (object_stat.st_dev, object_stat.st_ino) == (stat_result.st_dev, stat_result.st_ino)
+
+    try:
+        image_stat = os.stat(os.path.join(folder, f"{stem}.jpg"))
+    except FileNotFoundError:
+        return False
+    return get_version(image_stat) == version and stat_result.st_mtime_ns >= image_stat.st_mtime_ns
+
+
+class MediaFileResponse(FileResponse):
+    """File response streaming the file in bigger chunks than the default 4KiB, or only a byte range of it."""
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, path: str, *args, **kwargs):
+        super().__init__(path, *args, **kwargs)
+        self.headers["accept-ranges"] = "bytes"
+        self.byte_range: Optional[tuple[int, int]] = None
+
+    def with_range(self, request_headers: Headers) -> Response:
+        """Restricts the response to the range requested with a Range header, unless If-Range is outdated.
+
+        :returns: The response itself, or a 416 response if the range can't be satisfied
+        """
+        size = self.stat_result.st_size
+        etag = self.headers["etag"]
+        if self.status_code != 200 or "range" not in request_headers:
+            return self
+        if request_headers.get("if-range", etag) != etag:
+            return self
+        try:
+            self.byte_range = parse_range(request_headers["range"], size)
+        except ValueError:
+            return Response(status_code=416, headers={"content-range": f"bytes */{size}"})
+        if self.byte_range is not None:
+            start, end = self.byte_range
+            self.status_code = 206
+            self.headers["content-range"] = f"bytes {start}-{end - 1}/{size}"
+            self.headers["content-length"] = str(end - start)
+        return self
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if self.byte_range is None:
+            return await super().__call__(scope, receive, send)
+
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.send_header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        start, end = self.byte_range
+        async with aiofiles.open(self.path, mode="rb") as file:
+            await file.seek(start)
+            remaining = end - start
+            more_body = True
+            while more_body:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                remaining -= len(chunk)
+                # Stops early if the file was truncated in between
+                more_body = bool(chunk) and remaining > 0
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+
+def is_not_modified(response_headers: Headers, request_headers: Headers) -> bool:
+    """Checks the If-None-Match header of the request against the ETag of the response."""
+    # If-Modified-Since is ignored when If-None-Match is provided, which uses a weak comparison
+    etag = response_headers["etag"]
+    tags = (tag.strip() for tag in request_headers["if-none-match"].split(","))
+    return any(tag == "*" or tag.removeprefix("W/") == etag for tag in tags)
+
+
+def get_query_version(scope: Scope) -> Optional[str]:
+    """Version given in the query of a request (?v=), if any."""
+    query = parse_qs(scope.get("query_string", b"").decode())
+    return query["v"][0] if "v" in query else None
+
+
+def cache_control(immutable: bool = False) -> str:
+    return IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+
+
+def media_response(request: Request, media_file: str) -> Response:
+    """Response sending a file of the media folder, once the request has been authorized.
+    Depending on the media delivery setting, the file is either sent by the API
+    or by the reverse proxy in front of it (X-Accel-Redirect for nginx, X-Sendfile for Apache/lighttpd).
+
+    :param request: Request asking for the file, used for the caching headers
+    :param media_file: Path of the file relative to the media folder, with forward slashes
+    """
+    full_path = os.path.join(global_settings.media_path, *media_file.split("/"))
+    try:
+        stat_result = os.stat(full_path)
+    except FileNotFoundError:
+        raise NotFoundHTTPException("File not found")
+    version = get_query_version(request.scope)
+    headers = {
+        "cache-control": cache_control(version is not None and is_current_version(full_path, stat_result, version))
+    }
+    if global_settings.media_delivery == "x-accel-redirect":
+        headers["x-accel-redirect"] = quote(f"{global_settings.media_accel_prefix.rstrip('/')}/{media_file}")
+        return Response(headers=headers)
+    if global_settings.media_delivery == "x-sendfile":
+        headers["x-sendfile"] = full_path
+        return Response(headers=headers)
+
+    headers["etag"] = get_etag(stat_result)
+    response = MediaFileResponse(full_path, headers=headers, stat_result=stat_result, method=request.method)
+    if "if-none-match" in request.headers and is_not_modified(response.headers, request.headers):
+        return NotModifiedResponse(response.headers)
+    return response.with_range(request.headers)
+
+
+def parse_range(range_header: str, size: int) -> Optional[tuple[int, int]]:
+    """Parses the Range header of a request, only single byte ranges are supported.
+
+    :returns: The start and the (excluded) end of the range, None if the header should be ignored
+    :raises ValueError: If the range can't be satisfied
+    """
+    unit, _, byte_range = range_header.partition("=")
+    first, _, last = byte_range.strip().partition("-")
+    if unit.strip() != "bytes" or not (first or last) or not all(p.isdigit() for p in (first, last) if p):
+        return None
+
+    if not first:
+        if not int(last):
+            raise ValueError("Empty suffix range")
+        return max(size - int(last), 0), size
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError("Range starting after the end of the content")
+    end = min(int(last) + 1, size) if last else size
+    return start, end
+
+
+def archive_response(request: Request, archive: StoredZip, filename: str, media_type: str) -> Response:
+    """Response streaming an archive generated on the fly, or the part of it requested with a Range header.
+
+    :param request: Request asking for the archive
+    :param archive: Archive to send
+    :param filename: Name of the downloaded file
+    :param media_type: Media type of the archive
+    """
+    headers = {
+        "accept-ranges": "bytes",
+        "etag": archive.etag,
+        "cache-control": cache_control(get_query_version(request.scope) == archive.etag.strip('"')),
+        "content-disposition": f"attachment; filename*=utf-8''{quote(filename)}",
+    }
+    if "if-none-match" in request.headers and is_not_modified(Headers(headers), request.headers):
+        return NotModifiedResponse(Headers(headers))
+
+    byte_range = None
+    if "range" in request.headers and request.headers.get("if-range", archive.etag) == archive.etag:
+        try:
+            byte_range = parse_range(request.headers["range"], archive.size)
+        except ValueError:
+            return Response(status_code=416, headers={"content-range": f"bytes */{archive.size}"})
+
+    if byte_range is None:
+        headers["content-length"] = str(archive.size)
+        return StreamingResponse(archive.iter_range(), media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    headers["content-range"] = f"bytes {start}-{end - 1}/{archive.size}"
+    headers["content-length"] = str(end - start)
+    return StreamingResponse(archive.iter_range(start, end), status_code=206, media_type=media_type, headers=headers)
+
+
+class MediaFiles(StaticFiles):
+    """Serves the media folder with strong ETags and caching headers.
+    Requests with the current version of the file in their query (?v=) and content-addressed files
+    can be cached forever, other files need to be revalidated.
+    """
+
+    def file_response(
+        self,
+        full_path: str,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        headers = {"etag": get_etag(stat_result), "cache-control": self.cache_control(scope, full_path, stat_result)}
+        response = MediaFileResponse(
+            full_path, status_code=status_code, headers=headers, stat_result=stat_result, method=scope["method"]
+        )
+        request_headers = Headers(scope=scope)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response.with_range(request_headers)
+
+    def cache_control(self, scope: Scope, full_path: str, stat_result: os.stat_result):
+        if self.get_path(scope).split(os.sep)[0] in IMMUTABLE_FOLDERS:
+            return cache_control(True)
+        version = get_query_version(scope)
+        return cache_control(version is not None and is_current_version(full_path, stat_result, version))
+
+    def is_not_modified(self, response_headers: Headers, request_headers: Headers) -> bool:
+        if "if-none-match" not in request_headers:
+            return super().is_not_modified(response_headers, request_headers)
+        return is_not_modified(response_headers, request_headers)
@@ -1,3 +1,3 @@
-from . import base, chapter, comment, manga, upload, user
+from . import base, chapter, comment, image, manga, upload, user
 
 metadata = base.Base.metadata
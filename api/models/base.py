@@ -1,13 +1,81 @@
+import json
 import uuid
-from typing import Any
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from typing import Any, Iterable, Optional, Sequence
 
-from sqlalchemy import Column, Integer, func, select
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    cast,
+    column,
+    delete,
+    false,
+    func,
+    insert,
+    select,
+    table,
+    true,
+    tuple_,
+)
+from sqlalchemy.dialects.postgresql import REGCLASS, UUID
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import as_declarative, declared_attr
 from sqlalchemy.orm import joinedload
+from sqlalchemy.sql.expression import ClauseElement, Executable
 
-from ..exceptions import NotFoundHTTPException, UnprocessableEntityHTTPException
+from ..cache import TTLCache
+from ..config import get_settings
+from ..exceptions import BadRequestHTTPException, NotFoundHTTPException, UnprocessableEntityHTTPException
+from ..fastapi_permissions import CompiledACL
+
+global_settings = get_settings()
+
+# Totals of the paginated queries, when they are cached
+total_cache = TTLCache(global_settings.pagination_total_ttl)
+
+
+class Explain(Executable, ClauseElement):
+    """EXPLAIN (FORMAT JSON) of a statement, to get the estimations of the planner."""
+
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain, "postgresql")
+def _compile_explain(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+
+def encode_cursor(values: Sequence) -> str:
+    """Opaque cursor pointing to a row, from the values it's sorted by."""
+    values = [v.isoformat() if isinstance(v, datetime) else str(v) if isinstance(v, uuid.UUID) else v for v in values]
+    return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str, keys: Sequence) -> list:
+    """Values of the row a cursor points to, parsed with the types of the keys it was sorted by."""
+    try:
+        values = json.loads(urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError("Wrong amount of values")
+        parsed = []
+        for key, value in zip(keys, values):
+            if isinstance(key.type, DateTime):
+                value = datetime.fromisoformat(value)
+            elif isinstance(key.type, UUID):
+                value = uuid.UUID(value)
+            elif not isinstance(value, (int, float)):
+                raise ValueError("Invalid number")
+            parsed.append(value)
+        return parsed
+    except (ValueError, TypeError):
+        raise BadRequestHTTPException("Invalid cursor")
 
 
 @as_declarative()
@@ -33,6 +101,26 @@ class Base:
         except SQLAlchemyError:
             raise UnprocessableEntityHTTPException("Database error")
 
+    @classmethod
+    async def save_all(cls, db_session: AsyncSession, rows: list[dict]):
+        """
+        Creates all the rows with a single INSERT statement
+        :param db_session:
+        :param rows: values of each row to create
+        :return: the created instances, in the same order as the rows
+        """
+        if not rows:
+            return []
+        try:
+            values = [{**row, "version": 1} for row in rows]
+            stmt = insert(cls).values(values).returning(*cls.__table__.columns)
+            result = await db_session.execute(select(cls).from_statement(stmt))
+            instances = result.scalars().all()
+            await db_session.commit()
+            return instances
+        except SQLAlchemyError:
+            raise UnprocessableEntityHTTPException("Database error")
+
     async def delete(self, db_session: AsyncSession):
         """
         :param db_session:
@@ -45,6 +133,22 @@ class Base:
         except SQLAlchemyError:
             raise UnprocessableEntityHTTPException("Database error")
 
+    @classmethod
+    async def delete_where(cls, db_session: AsyncSession, *whereclause):
+        """
+        Deletes all the rows matching the criteria with a single DELETE statement
+        :param db_session:
+        :param whereclause: criteria the deleted rows need to match
+        :return:
+        """
+        try:
+            stmt = delete(cls).where(*whereclause).execution_options(synchronize_session=False)
+            await db_session.execute(stmt)
+            await db_session.commit()
+            return "OK"
+        except SQLAlchemyError:
+            raise UnprocessableEntityHTTPException("Database error")
+
     async def update(self, db_session: AsyncSession, **kwargs):
         """
         :param db_session:
@@ -55,6 +159,27 @@ class Base:
             setattr(self, k, v)
         await self.save(db_session)
 
+    @classmethod
+    def permitted_clause(cls, principals: Iterable[str], permission: str, owner: str = "owner_id"):
+        """
+        SQL condition matching the rows a user has the permission for, so they're filtered by the database
+        :param principals: principals of the user
+        :param owner: column of the user the row ACL depends on, the model builds the row ACL of an owner
+        with its __owner_acl__ static method
+        :return: true or false if the class ACL decides, else a condition on the owner of the rows
+        """
+        principals = frozenset(principals)
+        allowed = cls.__class_acl__().check(principals, permission)
+        if allowed is not None:
+            return true() if allowed else false()
+
+        # The ACL of the rows owned by the user tells if owning them is enough
+        user_ids = [uuid.UUID(principal[5:]) for principal in principals if principal.startswith("user:")]
+        owned = [
+            user_id for user_id in user_ids if CompiledACL(cls.__owner_acl__(user_id)).check(principals, permission)
+        ]
+        return getattr(cls, owner).in_(owned) if owned else false()
+
     @classmethod
     async def find(cls, db_session: AsyncSession, _id: uuid.UUID, exception=NotFoundHTTPException()):
         stmt = select(cls).where(cls.id == _id)
@@ -80,8 +205,84 @@ class Base:
 
     @classmethod
     async def pagination(cls, db_session, stmt, limit, offset, order_by):
-        count_stmt = stmt.with_only_columns(func.count(cls.id))
-        count_result = await db_session.execute(count_stmt)
         page_stmt = stmt.order_by(*order_by).offset(offset).limit(limit)
+        count, rows = await cls._paginate(db_session, stmt, page_stmt, offset)
+        return count, [row[0] for row in rows]
+
+    @classmethod
+    async def keyset_pagination(cls, db_session, stmt, limit, offset, sort_keys: tuple, after: Optional[str] = None):
+        """
+        Paginates the rows in the descending order of the sort keys
+        :param db_session:
+        :param sort_keys: columns or expressions the rows are ordered by, the ids break the ties
+        :param after: cursor of the last row of the previous page, replaces the offset,
+        the rows before it are skipped by the index instead of being scanned
+        :return: the total, the page and the cursor of the next page (None for the last one)
+        """
+        keys = (*sort_keys, cls.id)
+        page_stmt = stmt.add_columns(*keys).order_by(*(key.desc() for key in keys)).limit(limit)
+        if after is None:
+            count, rows = await cls._paginate(db_session, stmt, page_stmt.offset(offset), offset)
+        else:
+            cursor = tuple_(*decode_cursor(after, keys), types=[key.type for key in keys])
+            page_result = await db_session.execute(page_stmt.where(tuple_(*keys) < cursor))
+            count, rows = await cls.count(db_session, stmt), page_result.all()
+
+        cursor = None
+        if len(rows) == limit:
+            cursor = encode_cursor([rows[-1][i + 1] for i in range(len(keys))])
+        return count, [row[0] for row in rows], cursor
+
+    @classmethod
+    async def _paginate(cls, db_session, stmt, page_stmt, offset):
+        # An exact total is counted along with the page, unless it's past the last row
+        if global_settings.pagination_total == "exact":
+            result = await db_session.execute(page_stmt.add_columns(func.count().over()))
+            rows = result.all()
+            if rows or not offset:
+                return rows[0][-1] if rows else 0, rows
+            return await cls.count(db_session, stmt), []
+
         page_result = await db_session.execute(page_stmt)
-        return count_result.scalars().first(), page_result.scalars().all()
+        return await cls.count(db_session, stmt), page_result.all()
+
+    @classmethod
+    async def count(cls, db_session, stmt) -> Optional[int]:
+        """
+        Counts the rows selected by the statement, depending on the pagination total setting:
+        exact, estimated by the planner, cached for a while or not counted at all (None)
+        :param db_session:
+        :param stmt: select statement of the rows, without order, limit or offset
+        :return:
+        """
+        mode = global_settings.pagination_total
+        if mode == "none":
+            return None
+
+        if mode == "estimated":
+            if stmt.whereclause is None:
+                reltuples_stmt = select(column("reltuples")).select_from(table("pg_class"))
+                reltuples_stmt = reltuples_stmt.where(column("oid") == cast(cls.__tablename__, REGCLASS))
+                result = await db_session.execute(reltuples_stmt)
+                # The table was never analyzed when it's negative
+                estimate = result.scalar()
+                if estimate >= 0:
+                    return round(estimate)
+            result = await db_session.execute(Explain(stmt.with_only_columns(cls.id)))
+            return result.scalar()[0]["Plan"]["Plan Rows"]
+
+        count_stmt = stmt.with_only_columns(func.count(cls.id))
+        if mode == "cached":
+            compiled = count_stmt.compile()
+            # The expanding IN parameters are lists, which can't be hashed
+            params = ((name, tuple(v) if isinstance(v, (list, tuple)) else v) for name, v in compiled.params.items())
+            key = (str(compiled), tuple(sorted(params)))
+            count = total_cache.get(key)
+            if count is None:
+                count_result = await db_session.execute(count_stmt)
+                count = count_result.scalar()
+                total_cache.set(key, count)
+            return count
+
+        count_result = await db_session.execute(count_stmt)
+        return count_result.scalar()
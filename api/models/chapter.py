@@ -1,13 +1,21 @@
 import uuid
+from typing import Iterable, Optional
 
-from sqlalchemy import Boolean, Column, DateTime, Float, ForeignKey, Integer, String, func, select
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, String, func, select
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import joinedload, relationship
 
-from ..fastapi_permissions import Allow, Everyone
+from ..cache import TTLCache
+from ..config import get_settings
+from ..fastapi_permissions import Allow, Everyone, compiled_acl
 from .base import Base
 
+global_settings = get_settings()
+
+# Distinct scan groups of the chapters, it needs to be cleared when a chapter is created, edited or deleted
+groups_cache = TTLCache(global_settings.groups_cache_ttl, maxsize=1)
+
 
 class Chapter(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
@@ -17,6 +25,7 @@ class Chapter(Base):
     volume = Column(Integer, nullable=True)
     number = Column(Float, nullable=False)
     length = Column(Integer, nullable=False)
+    pages = Column(ARRAY(String(64)))
     webtoon = Column(Boolean, default=False, nullable=False)
     upload_time = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     manga_id = Column(UUID(as_uuid=True), ForeignKey("manga.id", ondelete="CASCADE"), nullable=False)
@@ -24,16 +33,27 @@ class Chapter(Base):
     sessions = relationship("UploadSession", back_populates="chapter", cascade="all, delete", passive_deletes=True)
     comments = relationship("Comment", back_populates="chapter", cascade="all, delete", passive_deletes=True)
 
+    __table_args__ = (
+        Index("ix_chapter_manga_id_number", manga_id, number),
+        Index("ix_chapter_upload_time_id", upload_time, id),
+        Index("ix_chapter_owner_id_upload_time_id", owner_id, upload_time, id),
+    )
     __mapper_args__ = {"eager_defaults": True}
 
     @property
     def __acl__(self):
-        return (
-            *self.__class_acl__(),
-            (Allow, ["role:uploader", f"user:{self.owner_id}"], "edit"),
-        )
+        return self.__class_acl__().extend(self.__row_acl__)
+
+    def __row_acl__(self):
+        return self.__owner_acl__(self.owner_id)
+
+    @staticmethod
+    def __owner_acl__(owner_id) -> tuple:
+        """Entries of the rows owned by a user, the row ACL only depends on its owner"""
+        return ((Allow, ["role:uploader", f"user:{owner_id}"], "edit"),)
 
     @classmethod
+    @compiled_acl
     def __class_acl__(cls):
         return (
             (Allow, [Everyone], "view"),
@@ -41,9 +61,21 @@ class Chapter(Base):
         )
 
     @classmethod
-    async def latest(cls, db_session: AsyncSession, limit: int = 20, offset: int = 0):
+    async def latest(cls, db_session: AsyncSession, limit: int = 20, offset: int = 0, after: Optional[str] = None):
         stmt = select(cls).options(joinedload(cls.manga))
-        return await cls.pagination(db_session, stmt, limit, offset, (cls.upload_time.desc(),))
+        return await cls.keyset_pagination(db_session, stmt, limit, offset, (cls.upload_time,), after)
+
+    @classmethod
+    async def editable(
+        cls,
+        db_session: AsyncSession,
+        principals: Iterable[str],
+        limit: int = 20,
+        offset: int = 0,
+        after: Optional[str] = None,
+    ):
+        stmt = select(cls).where(cls.permitted_clause(principals, "edit")).options(joinedload(cls.manga))
+        return await cls.keyset_pagination(db_session, stmt, limit, offset, (cls.upload_time,), after)
 
     @classmethod
     async def from_manga(cls, db_session: AsyncSession, manga_id: uuid.UUID):
@@ -52,7 +84,19 @@ class Chapter(Base):
         return result.scalars().all()
 
     @classmethod
-    async def get_groups(cls, db_session: AsyncSession):
-        stmt = select(cls.scan_group).distinct()
+    async def pages_of_manga(cls, db_session: AsyncSession, manga_id: uuid.UUID) -> list[str]:
+        """Hashes of the pages of every chapter of the manga, once per occurrence"""
+        stmt = select(func.unnest(cls.pages)).where(cls.manga_id == manga_id)
         result = await db_session.execute(stmt)
         return result.scalars().all()
+
+    @classmethod
+    async def get_groups(cls, db_session: AsyncSession, prefix: str = ""):
+        groups = groups_cache.get("groups")
+        if groups is None:
+            stmt = select(cls.scan_group).distinct()
+            result = await db_session.execute(stmt)
+            groups = result.scalars().all()
+            groups_cache.set("groups", groups)
+        prefix = prefix.casefold()
+        return [group for group in groups if group.casefold().startswith(prefix)]
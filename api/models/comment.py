@@ -1,17 +1,18 @@
 import uuid
+from typing import Optional
 
-from sqlalchemy import Column, DateTime, ForeignKey, String, func, select
+from sqlalchemy import Column, DateTime, ForeignKey, Index, String, func, select
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import joinedload, relationship
 
-from ..fastapi_permissions import Allow, Authenticated, Everyone
+from ..fastapi_permissions import Allow, Authenticated, Everyone, compiled_acl
 from .base import Base
 
 
 class Comment(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    author_id = Column(UUID(as_uuid=True), ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
+    author_id = Column(UUID(as_uuid=True), ForeignKey("user.id", ondelete="CASCADE"), nullable=False, index=True)
     content = Column(String, nullable=False)
     chapter_id = Column(UUID(as_uuid=True), ForeignKey("chapter.id", ondelete="CASCADE"), nullable=False)
     reply_to = Column(UUID(as_uuid=True))
@@ -19,16 +20,23 @@ class Comment(Base):
     chapter = relationship("Chapter", back_populates="comments")
     author = relationship("User", back_populates="comments")
 
+    __table_args__ = (Index("ix_comment_chapter_id_create_time_id", chapter_id, create_time, id),)
     __mapper_args__ = {"eager_defaults": True}
 
     @property
     def __acl__(self):
-        return (
-            *self.__class_acl__(),
-            (Allow, [f"user:{self.author_id}"], "edit"),
-        )
+        return self.__class_acl__().extend(self.__row_acl__)
+
+    def __row_acl__(self):
+        return self.__owner_acl__(self.author_id)
+
+    @staticmethod
+    def __owner_acl__(author_id) -> tuple:
+        """Entries of the comments written by a user, the row ACL only depends on its author"""
+        return ((Allow, [f"user:{author_id}"], "edit"),)
 
     @classmethod
+    @compiled_acl
     def __class_acl__(cls):
         return (
             (Allow, [Everyone], "view"),
@@ -44,6 +52,7 @@ class Comment(Base):
         chapter_id: uuid.UUID,
         limit: int = 20,
         offset: int = 0,
+        after: Optional[str] = None,
     ):
         stmt = select(cls).where(cls.chapter_id == chapter_id).options(joinedload(cls.author))
-        return await cls.pagination(db_session, stmt, limit, offset, (cls.create_time.desc(),))
+        return await cls.keyset_pagination(db_session, stmt, limit, offset, (cls.create_time,), after)
@@ -0,0 +1,96 @@
+import asyncio
+from collections import Counter, defaultdict
+from typing import Iterable
+
+from sqlalchemy import Column, Integer, String, delete, func, select, union_all, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..exceptions import UnprocessableEntityHTTPException
+from ..storage import remove_objects
+from .base import Base
+from .chapter import Chapter
+from .upload import UploadedBlob
+
+
+class StoredImage(Base):
+    id = Column(String(64), primary_key=True)
+    refcount = Column(Integer, nullable=False, default=0)
+
+    @classmethod
+    async def acquire(cls, db_session: AsyncSession, digests: Iterable[str]):
+        """
+        Adds a reference to each image, once per occurrence
+        :param db_session:
+        :param digests: hashes of the referenced images
+        :return:
+        """
+        counts = Counter(digests)
+        if not counts:
+            return
+        try:
+            stmt = insert(cls).values([{"id": d, "refcount": n, "version": 1} for d, n in counts.items()])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[cls.id],
+                set_={"refcount": cls.refcount + stmt.excluded.refcount},
+            )
+            await db_session.execute(stmt)
+            await db_session.commit()
+        except SQLAlchemyError:
+            raise UnprocessableEntityHTTPException("Database error")
+
+    @classmethod
+    async def release(cls, db_session: AsyncSession, digests: Iterable[str]):
+        """
+        Removes a reference to each image, once per occurrence
+        :param db_session:
+        :param digests: hashes of the images that aren't referenced anymore
+        :return:
+        """
+        by_count = defaultdict(list)
+        for digest, count in Counter(digests).items():
+            by_count[count].append(digest)
+        if not by_count:
+            return
+        try:
+            for count, ids in by_count.items():
+                stmt = update(cls).where(cls.id.in_(ids)).values(refcount=cls.refcount - count)
+                await db_session.execute(stmt.execution_options(synchronize_session=False))
+            await db_session.commit()
+        except SQLAlchemyError:
+            raise UnprocessableEntityHTTPException("Database error")
+
+    @classmethod
+    async def recount(cls, db_session: AsyncSession):
+        """
+        Recomputes every refcount from the blobs and chapter pages referencing the images
+        :param db_session:
+        :return:
+        """
+        refs = union_all(
+            select(UploadedBlob.hash.label("id")),
+            select(func.unnest(Chapter.pages).label("id")),
+        ).subquery()
+        count = select(func.count()).select_from(refs).where(refs.c.id == cls.id).scalar_subquery()
+        await db_session.execute(update(cls).values(refcount=count).execution_options(synchronize_session=False))
+        await db_session.commit()
+
+    @classmethod
+    async def collect(cls, db_session: AsyncSession):
+        """
+        Deletes the images that aren't referenced anymore, along with their files.
+        The rows stay locked until the files are removed, an image acquired meanwhile waits for it
+        and is then stored again, the images being acquired are skipped.
+        :param db_session:
+        :return: hashes of the deleted images
+        """
+        unused = select(cls.id).where(cls.refcount <= 0).with_for_update(skip_locked=True)
+        stmt = delete(cls).where(cls.id.in_(unused)).returning(cls.id)
+        result = await db_session.execute(stmt.execution_options(synchronize_session=False))
+        digests = result.scalars().all()
+        try:
+            await asyncio.to_thread(remove_objects, digests)
+        finally:
+            await db_session.commit()
+        return digests
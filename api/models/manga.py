@@ -1,15 +1,43 @@
 import enum
 import uuid
+from typing import Optional
 
-from sqlalchemy import Column, DateTime, Enum, ForeignKey, Numeric, String, func, select
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import (
+    Column,
+    Computed,
+    DateTime,
+    Enum,
+    Float,
+    ForeignKey,
+    Index,
+    Numeric,
+    String,
+    Text,
+    cast,
+    func,
+    literal_column,
+    select,
+)
+from sqlalchemy.dialects.postgresql import TSVECTOR, UUID
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship
+from sqlalchemy.types import UserDefinedType
 
-from ..fastapi_permissions import Allow, Everyone
+from ..fastapi_permissions import Allow, Everyone, compiled_acl
 from .base import Base
 
 
+class TSQUERY(UserDefinedType):
+    cache_ok = True
+
+    def get_col_spec(self, **kw):
+        return "TSQUERY"
+
+
+# No stemming nor stop words, as the titles and names can be in any language
+SEARCH_CONFIG = literal_column("'simple'::regconfig")
+
+
 class Status(str, enum.Enum):
     ongoing = "ongoing"
     completed = "completed"
@@ -25,21 +53,50 @@ class Manga(Base):
     author = Column(String, nullable=False)
     artist = Column(String, nullable=False)
     create_time = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    cover_version = Column(String)
     year = Column(Numeric(4, 0))
     status = Column(Enum(Status), nullable=False)
     chapters = relationship("Chapter", back_populates="manga", cascade="all, delete", passive_deletes=True)
     sessions = relationship("UploadSession", back_populates="manga", cascade="all, delete", passive_deletes=True)
+    search_vector = deferred(
+        Column(
+            TSVECTOR,
+            Computed(
+                "setweight(to_tsvector('simple', title), 'A') || "
+                "setweight(to_tsvector('simple', author), 'B') || "
+                "setweight(to_tsvector('simple', artist), 'B') || "
+                "setweight(to_tsvector('simple', description), 'C')"
+            ),
+        )
+    )
 
+    __table_args__ = (
+        Index("ix_manga_search_vector", search_vector, postgresql_using="gin"),
+        Index("ix_manga_create_time_id", create_time, id),
+    )
     __mapper_args__ = {"eager_defaults": True}
 
     @property
     def __acl__(self):
-        return (
-            *self.__class_acl__(),
-            (Allow, ["role:uploader", f"user:{self.owner_id}"], "edit"),
-        )
+        return self.__class_acl__().extend(self.__row_acl__)
+
+    def __row_acl__(self):
+        return self.__owner_acl__(self.owner_id)
+
+    @staticmethod
+    def __owner_acl__(owner_id) -> tuple:
+        """Entries of the rows owned by a user, the row ACL only depends on its owner"""
+        return ((Allow, ["role:uploader", f"user:{owner_id}"], "edit"),)
+
+    @property
+    def cover(self) -> Optional[str]:
+        """Versioned path of the cover, None until one is uploaded"""
+        if self.cover_version is None:
+            return None
+        return f"/media/{self.id}/cover.jpg?v={self.cover_version}"
 
     @classmethod
+    @compiled_acl
     def __class_acl__(cls):
         return (
             (Allow, [Everyone], "view"),
@@ -49,7 +106,17 @@ class Manga(Base):
         )
 
     @classmethod
-    async def search(cls, db_session: AsyncSession, title: str, limit: int = 20, offset: int = 0):
-        escaped_title = title.replace("%", "\\%")
-        stmt = select(cls).where(cls.title.ilike(f"%{escaped_title}%"))
-        return await cls.pagination(db_session, stmt, limit, offset, (cls.create_time.desc(),))
+    async def search(
+        cls, db_session: AsyncSession, title: str, limit: int = 20, offset: int = 0, after: Optional[str] = None
+    ):
+        stmt = select(cls)
+        if not title.strip():
+            return await cls.keyset_pagination(db_session, stmt, limit, offset, (cls.create_time,), after)
+
+        # Every word of the search is matched as a prefix, to give results while the user types
+        # The lexemes are cast back as they are, to_tsquery would parse them again and could split them
+        words = cast(func.plainto_tsquery(SEARCH_CONFIG, title), Text)
+        query = cast(func.regexp_replace(words, r"'(\s|$)", r"':*\1", "g"), TSQUERY)
+        rank = func.ts_rank(cls.search_vector, query, type_=Float)
+        stmt = stmt.where(cls.search_vector.op("@@")(query))
+        return await cls.keyset_pagination(db_session, stmt, limit, offset, (rank, cls.create_time), after)
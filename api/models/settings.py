@@ -2,7 +2,7 @@ import json
 import os
 
 from ..config import get_settings
-from ..fastapi_permissions import Allow, Everyone
+from ..fastapi_permissions import Allow, CompiledACL, Everyone
 from ..schemas.settings import SettingsSchema
 
 global_settings = get_settings()
@@ -12,9 +12,11 @@ settings_path = os.path.join(global_settings.media_path, "settings.json")
 class Settings:
     custom_settings = None
 
-    __acl__ = (
-        (Allow, [Everyone], "view"),
-        (Allow, ["role:admin"], "edit"),
+    __acl__ = CompiledACL(
+        (
+            (Allow, [Everyone], "view"),
+            (Allow, ["role:admin"], "edit"),
+        )
     )
 
     def __init__(self):
@@ -1,32 +1,47 @@
 import uuid
+from typing import Iterable
 
-from sqlalchemy import Column, ForeignKey, String, delete, select
+from sqlalchemy import Column, DateTime, ForeignKey, Index, String, delete, func, select
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, selectinload
 
-from ..fastapi_permissions import Allow
+from ..fastapi_permissions import Allow, compiled_acl
 from .base import Base
 
 
 class UploadSession(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    owner_id = Column(UUID(as_uuid=True), ForeignKey("user.id", name="fk_session_owner", ondelete="CASCADE"))
-    chapter_id = Column(UUID(as_uuid=True), ForeignKey("chapter.id", ondelete="CASCADE"))
-    manga_id = Column(UUID(as_uuid=True), ForeignKey("manga.id", ondelete="CASCADE"), nullable=False)
+    owner_id = Column(
+        UUID(as_uuid=True), ForeignKey("user.id", name="fk_session_owner", ondelete="CASCADE"), index=True
+    )
+    chapter_id = Column(UUID(as_uuid=True), ForeignKey("chapter.id", ondelete="CASCADE"), index=True)
+    manga_id = Column(UUID(as_uuid=True), ForeignKey("manga.id", ondelete="CASCADE"), nullable=False, index=True)
+    create_time = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     manga = relationship("Manga", back_populates="sessions")
     chapter = relationship("Chapter", back_populates="sessions")
     blobs = relationship("UploadedBlob", back_populates="session", cascade="all, delete", passive_deletes=True)
 
+    __table_args__ = (Index("ix_uploadsession_create_time_id", create_time, id),)
+    __mapper_args__ = {"eager_defaults": True}
+
     @property
     def __acl__(self):
+        return self.__class_acl__().extend(self.__row_acl__)
+
+    def __row_acl__(self):
+        return self.__owner_acl__(self.owner_id)
+
+    @staticmethod
+    def __owner_acl__(owner_id) -> tuple:
+        """Entries of the sessions owned by a user, the row ACL only depends on its owner"""
         return (
-            *self.__class_acl__(),
-            (Allow, ["role:uploader", f"user:{self.owner_id}"], "view"),
-            (Allow, ["role:uploader", f"user:{self.owner_id}"], "edit"),
+            (Allow, ["role:uploader", f"user:{owner_id}"], "view"),
+            (Allow, ["role:uploader", f"user:{owner_id}"], "edit"),
         )
 
     @classmethod
+    @compiled_acl
     def __class_acl__(cls):
         return (
             (Allow, ["role:admin"], "create"),
@@ -35,6 +50,11 @@ class UploadSession(Base):
             (Allow, ["role:admin"], "edit"),
         )
 
+    @classmethod
+    async def editable(cls, db_session: AsyncSession, principals: Iterable[str], limit: int = 20, offset: int = 0):
+        stmt = select(cls).where(cls.permitted_clause(principals, "edit")).options(selectinload(cls.blobs))
+        return await cls.pagination(db_session, stmt, limit, offset, (cls.create_time, cls.id))
+
     @classmethod
     async def flush(cls, db_session: AsyncSession):
         stmt = delete(cls)
@@ -44,7 +64,10 @@ class UploadSession(Base):
 class UploadedBlob(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     name = Column(String, nullable=False)
-    session_id = Column(UUID(as_uuid=True), ForeignKey("uploadsession.id", ondelete="CASCADE"), nullable=False)
+    hash = Column(String(64))
+    session_id = Column(
+        UUID(as_uuid=True), ForeignKey("uploadsession.id", ondelete="CASCADE"), nullable=False, index=True
+    )
     session = relationship("UploadSession", back_populates="blobs")
 
     @classmethod
@@ -53,3 +76,10 @@ class UploadedBlob(Base):
         result = await db_session.execute(stmt)
 
         return result.scalars().all()
+
+    @classmethod
+    async def from_sessions(cls, db_session: AsyncSession, *whereclause):
+        """Blobs of every upload session matching the clauses"""
+        stmt = select(cls).join(cls.session).where(*whereclause)
+        result = await db_session.execute(stmt)
+        return result.scalars().all()
@@ -8,7 +8,7 @@ from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import relationship
 
-from ..fastapi_permissions import Allow, Everyone
+from ..fastapi_permissions import Allow, Everyone, compiled_acl
 from .base import Base
 
 
@@ -32,13 +32,16 @@ class User(Base):
 
     @property
     def __acl__(self):
+        return self.__class_acl__().extend(self.__row_acl__)
+
+    def __row_acl__(self):
         return (
-            *self.__class_acl__(),
             (Allow, [f"user:{self.id}"], "view"),
             (Allow, [f"user:{self.id}"], "edit"),
         )
 
     @classmethod
+    @compiled_acl
     def __class_acl__(cls):
         return (
             (Allow, [Everyone], "register"),
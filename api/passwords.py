@@ -0,0 +1,60 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Optional
+
+from passlib.context import CryptContext
+from prometheus_client import Histogram
+
+from .config import get_settings
+
+global_settings = get_settings()
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+queue_wait = Histogram(
+    "password_hash_queue_seconds",
+    "Time the password hashes and verifications waited for a free worker.",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Returns the thread pool used for password hashing, creating it on first use.
+    bcrypt releases the GIL, so its size caps the amount of concurrent hashes.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=global_settings.password_hash_workers, thread_name_prefix="password-hash"
+        )
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+
+
+def _timed(func, queued_at: float, *args):
+    queue_wait.observe(time.perf_counter() - queued_at)
+    return func(*args)
+
+
+async def run_in_hasher(func, *args):
+    """Runs a hashing function in the thread pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), partial(_timed, func, time.perf_counter(), *args))
+
+
+async def hash_password(password: str) -> str:
+    return await run_in_hasher(pwd_context.hash, password)
+
+
+async def verify_password(password: str, hashed_password: str) -> bool:
+    return await run_in_hasher(pwd_context.verify, password, hashed_password)
@@ -0,0 +1,108 @@
+from importlib import import_module
+from math import ceil
+from typing import Callable, Iterable, Optional
+from urllib.parse import urlencode
+
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+
+from .cache import CacheBackend, MemoryBackend
+from .config import get_settings
+from .db import has_replica, is_recent_writer
+from .routers.auth import get_known_principals, get_token_claims, oauth2_scheme
+
+global_settings = get_settings()
+
+_backend: Optional[CacheBackend] = None
+
+GENERATION_KEY = "response:generation"
+# Set for a while after each invalidation, the replica may not have caught up with the write yet
+INVALIDATED_KEY = "response:invalidated"
+
+
+def get_backend() -> Optional[CacheBackend]:
+    """Returns the backend of the response cache, creating it on first use (None if it's disabled)."""
+    global _backend
+    if global_settings.response_cache == "none":
+        return None
+    if _backend is None and global_settings.response_cache == "memory":
+        _backend = MemoryBackend(global_settings.response_cache_size, global_settings.response_cache_ttl)
+    elif _backend is None:
+        # Shared backends come from optional dependencies, only needed to share the cache between several servers
+        _backend = load_factory(global_settings.response_cache)(global_settings.response_cache_url)
+    return _backend
+
+
+def load_factory(path: str) -> Callable[[Optional[str]], CacheBackend]:
+    """Imports a factory from its path, ex: "redis.asyncio:Redis.from_url"."""
+    module, _, attributes = path.partition(":")
+    factory = import_module(module)
+    for attribute in attributes.split("."):
+        factory = getattr(factory, attribute)
+    return factory
+
+
+async def invalidate_responses():
+    """Invalidates all the cached responses, by changing the generation of their keys."""
+    backend = get_backend()
+    if backend is not None:
+        await backend.incr(GENERATION_KEY)
+        if has_replica():
+            await backend.set(INVALIDATED_KEY, b"1", ex=ceil(global_settings.db_read_sticky_ttl))
+
+
+def get_principal_class(principals: Iterable[str]) -> str:
+    """The principals of the user, without the ones identifying them.
+    The cached responses are shared between the users of a same class.
+    """
+    return ",".join(sorted(p for p in principals if not p.startswith("user:")))
+
+
+def cached_response(endpoint: Callable):
+    """Marks a GET endpoint of a router using the CachedRoute class, its successful responses will be cached."""
+    endpoint.cached_response = True
+    return endpoint
+
+
+class CachedRoute(APIRoute):
+    """Route whose responses can be cached, the cache is checked before resolving any dependency.
+    The JSON body is cached as it was sent, for each path, query and class of principals.
+    """
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        if not getattr(self.endpoint, "cached_response", False):
+            return handler
+
+        async def cached_handler(request: Request) -> Response:
+            backend = get_backend()
+            # The clients that just wrote something read from the primary, not from the responses cached before
+            if backend is None or request.method != "GET" or is_recent_writer(request):
+                return await handler(request)
+
+            generation = (await backend.get(GENERATION_KEY) or b"0").decode()
+            query = urlencode(sorted(request.query_params.multi_items()))
+
+            def cache_key(principals: Iterable[str]) -> str:
+                return f"response:{generation}:{get_principal_class(principals)}:{request.url.path}?{query}"
+
+            # The principals are known from the token or the user cache, otherwise the user needs to be queried
+            # by the endpoint first, and its response can only be cached
+            principals = get_known_principals(request, await get_token_claims(request, await oauth2_scheme(request)))
+            if principals is not None:
+                content = await backend.get(cache_key(principals))
+                if content is not None:
+                    return Response(content, media_type="application/json", headers={"x-cache": "HIT"})
+
+            response = await handler(request)
+            principals = getattr(request.state, "principals", principals)
+            if principals is None:
+                return response
+            # The responses read from a lagging replica would be cached under the generation following the write
+            lagging = has_replica() and await backend.get(INVALIDATED_KEY) is not None
+            if response.status_code == 200 and not lagging:
+                await backend.set(cache_key(principals), response.body, ex=global_settings.response_cache_ttl)
+            response.headers["x-cache"] = "MISS"
+            return response
+
+        return cached_handler
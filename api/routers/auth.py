@@ -5,15 +5,18 @@ from uuid import UUID
 from fastapi import APIRouter, Depends, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import ExpiredSignatureError, JWTError, jwt
-from passlib.context import CryptContext
+from sqlalchemy import inspect
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
 
 from ..app import limiter
+from ..cache import TTLCache
 from ..config import get_settings
 from ..db import get_db
 from ..exceptions import AuthFailedHTTPException, PermissionsHTTPException
 from ..fastapi_permissions import Authenticated, Everyone, configure_permissions
 from ..models.user import User
+from ..passwords import verify_password
 from ..schemas.user import RefreshToken, TokenContent, TokenResponse
 
 auth_responses = {
@@ -33,44 +36,92 @@ router = APIRouter(tags=["Auth"], prefix="/auth")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token", auto_error=False)
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
+# Columns of the recently authenticated users, it needs to be cleared when a user is edited or deleted
+user_cache = TTLCache(settings.user_cache_ttl, settings.user_cache_size)
 
 
 async def authenticate_user(db_session: AsyncSession, username_mail: str, password: str):
     user = await User.from_username_email(db_session, username_mail)
-    if user and pwd_context.verify(password, user.hashed_password):
+    if user and await verify_password(password, user.hashed_password):
         return user
 
 
-def create_token(sub: UUID, typ: str, expires_delta: Optional[timedelta] = None):
+def create_token(sub: UUID, typ: str, expires_delta: Optional[timedelta] = None, user: Optional[User] = None):
+    """Creates a signed token for a user.
+    When the principal claims are enabled, the role and version of the given user are added to it.
+    """
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode = TokenContent(sub=str(sub), exp=expire, iat=datetime.utcnow(), typ=typ).dict()
+    claims = {}
+    if user is not None and settings.jwt_principal_claims:
+        claims = {"role": user.role, "ver": user.version}
+    to_encode = TokenContent(sub=str(sub), exp=expire, iat=datetime.utcnow(), typ=typ, **claims).dict(
+        exclude_none=True
+    )
     encoded_jwt = jwt.encode(to_encode, settings.jwt_secret_key, algorithm=settings.jwt_algorithm)
     return encoded_jwt
 
 
-async def get_connected_user(db_session: AsyncSession = Depends(get_db), token: str = Depends(oauth2_scheme)):
+async def find_user(db_session: AsyncSession, user_id: UUID, version: Optional[int] = None) -> Optional[User]:
+    """Finds the user of a token, the recently authenticated users are cached to skip the query.
+    The cached users are detached copies, the ones that need to be edited have to be queried.
+    """
+    user = get_cached_user(user_id, version)
+    if user is None:
+        user = await User.find(db_session, user_id, None)
+        if user is not None:
+            user_cache.set(user_id, {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs})
+    return user
+
+
+def get_cached_user(user_id: UUID, version: Optional[int] = None) -> Optional[User]:
+    """Returns the cached copy of a user, unless the token carries a newer version of it.
+    The edits made by another process only delete its own cached copy, the new tokens skip the stale ones here.
+    """
+    columns = user_cache.get(user_id)
+    if columns is None or (version is not None and columns["version"] < version):
+        return None
+    user = User(**columns)
+    make_transient_to_detached(user)
+    return user
+
+
+async def get_token_claims(request: Request, token: str = Depends(oauth2_scheme)) -> Optional[dict]:
+    """Decodes the session token of the request, None if it's missing or invalid.
+    It's decoded once per request, the claims are kept in its state.
+    """
+    if not hasattr(request.state, "token_claims"):
+        request.state.token_claims = _decode_session_token(token)
+    return request.state.token_claims
+
+
+def _decode_session_token(token: Optional[str]) -> Optional[dict]:
     if not token:
         return None
     try:
         payload = jwt.decode(token, settings.jwt_secret_key, algorithms=[settings.jwt_algorithm])
-        _id: str = payload.get("sub")
-        _type: str = payload.get("typ")
-        if _id is None or _type != "session":
+        if payload.get("sub") is None or payload.get("typ") != "session":
             return None
     except ExpiredSignatureError:
         return None
     except JWTError:
         return None
-    user = await User.find(db_session, UUID(_id), None)
-    return user
+    return payload
+
+
+async def get_connected_user(
+    request: Request,
+    db_session: AsyncSession = Depends(get_db),
+    claims: Optional[dict] = Depends(get_token_claims),
+):
+    """The user of the session token, it's looked up once per request and kept in its state."""
+    if not hasattr(request.state, "user"):
+        request.state.user = (
+            None if claims is None else await find_user(db_session, UUID(claims["sub"]), claims.get("ver"))
+        )
+    return request.state.user
 
 
 async def validate_refresh_token(token: str, db_session: AsyncSession):
@@ -97,22 +148,72 @@ async def is_connected(user: User = Depends(get_connected_user)):
         raise AuthFailedHTTPException()
 
 
-async def get_active_principals(user: User = Depends(get_connected_user)):
+def _principals(user: Optional[User]) -> frozenset:
     if user:
-        principals = [Everyone, Authenticated]
-        principals.extend(getattr(user, "principals", []))
+        return frozenset((Everyone, Authenticated, *getattr(user, "principals", [])))
+    return frozenset((Everyone,))
+
+
+async def get_active_principals(
+    request: Request,
+    db_session: AsyncSession = Depends(get_db),
+    claims: Optional[dict] = Depends(get_token_claims),
+):
+    """Principals of the connected user, kept in the state of the request.
+    If the token carries the role of the user, they are trusted until it expires and the user isn't queried.
+    """
+    principals = get_known_principals(request, claims)
+    if principals is None:
+        principals = _principals(await get_connected_user(request, db_session, claims))
+        request.state.principals = principals
+    return principals
+
+
+def get_known_principals(request: Request, claims: Optional[dict]) -> Optional[frozenset]:
+    """Principals of the connected user when they are known without querying it,
+    from the state of the request, the claims of the token or the user cache. None otherwise.
+    """
+    if hasattr(request.state, "principals"):
+        return request.state.principals
+    if claims is not None and settings.jwt_principal_claims and "role" in claims:
+        principals = frozenset((Everyone, Authenticated, f"user:{claims['sub']}", f"role:{claims['role']}"))
+    elif claims is None:
+        principals = _principals(None)
     else:
-        principals = [Everyone]
+        user = get_cached_user(UUID(claims["sub"]), claims.get("ver"))
+        if user is None:
+            return None
+        request.state.user = user
+        principals = _principals(user)
+    request.state.principals = principals
     return principals
 
 
+async def get_verified_principals(
+    request: Request,
+    db_session: AsyncSession = Depends(get_db),
+    claims: Optional[dict] = Depends(get_token_claims),
+):
+    """Principals of the connected user, for the endpoints where an edited or deleted user should lose its access.
+    If the token carries the version of the user, the user is queried and the token rejected once it's outdated.
+    """
+    if claims is not None and settings.jwt_principal_claims and "ver" in claims:
+        user = await User.find(db_session, UUID(claims["sub"]), None)
+        if user is None or user.version != claims["ver"]:
+            return _principals(None)
+        request.state.user = user
+        return _principals(user)
+    return await get_active_principals(request, db_session, claims)
+
+
 Permission = configure_permissions(get_active_principals)
+VerifiedPermission = configure_permissions(get_verified_principals)
 
 
 def token_response(user: User):
     access_token_expires = timedelta(minutes=settings.jwt_access_token_expire_minutes)
     refresh_token_expires = timedelta(days=15)
-    access_token = create_token(sub=user.id, typ="session", expires_delta=access_token_expires)
+    access_token = create_token(sub=user.id, typ="session", expires_delta=access_token_expires, user=user)
     refresh_token = create_token(sub=user.id, typ="refresh", expires_delta=refresh_token_expires)
     return {
         "token_type": "bearer",
@@ -1,7 +1,7 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..db import get_db
+from ..db import get_read_db
 from ..models.chapter import Chapter
 
 router = APIRouter(prefix="/autocomplete", tags=["Autocomplete"])
@@ -9,9 +9,10 @@ router = APIRouter(prefix="/autocomplete", tags=["Autocomplete"])
 
 @router.get("/groups", response_model=list[str])
 async def get_scan_groups(
-    db_session: AsyncSession = Depends(get_db),
+    prefix: str = Query("", description="Beginning of the group names, the case is ignored"),
+    db_session: AsyncSession = Depends(get_read_db),
 ):
-    groups = await Chapter.get_groups(db_session)
-    if "no group" not in groups:
+    groups = await Chapter.get_groups(db_session, prefix)
+    if "no group" not in groups and "no group".startswith(prefix.casefold()):
         groups.append("no group")
     return groups
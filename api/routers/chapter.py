@@ -3,52 +3,87 @@ import shutil
 from typing import Optional
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, Path, Query, Request
+from fastapi.responses import Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from ..archive import StoredZip
 from ..config import get_settings
-from ..db import get_db
+from ..db import get_db, get_read_db
 from ..exceptions import NotFoundHTTPException
 from ..fastapi_permissions import has_permission, permission_exception
-from ..models.chapter import Chapter
+from ..media import archive_response, media_response
+from ..models.chapter import Chapter, groups_cache
 from ..models.comment import Comment
-from ..schemas.chapter import ChapterResponse, ChapterSchema, DetailedChapterResponse, LatestChaptersResponse
+from ..models.image import StoredImage
+from ..response_cache import CachedRoute, cached_response, invalidate_responses
+from ..schemas.chapter import ChapterPagesResponse, ChapterResponse, ChapterSchema, LatestChaptersResponse
 from ..schemas.comment import ChapterCommentsResponse
 from .auth import Permission, auth_responses, get_active_principals
 
 settings = get_settings()
 
-router = APIRouter(prefix="/chapter", tags=["Chapter"])
+# ex: 1.jpg, 1.webp, 1.720.jpg
+PAGE_NAME = r"^(\d+)(\.\d+)?\.(jpg|webp|avif)$"
+ARCHIVE_MEDIA_TYPES = {"cbz": "application/vnd.comicbook+zip", "zip": "application/zip"}
+
+router = APIRouter(prefix="/chapter", tags=["Chapter"], route_class=CachedRoute)
 
 
 async def _get_chapter(chapter_id: UUID, db_session: AsyncSession = Depends(get_db)):
     return await Chapter.find(db_session, chapter_id, NotFoundHTTPException("Chapter not found"))
 
 
+async def _get_read_chapter(chapter_id: UUID, db_session: AsyncSession = Depends(get_read_db)):
+    return await Chapter.find(db_session, chapter_id, NotFoundHTTPException("Chapter not found"))
+
+
 async def _get_detailed_chapter(chapter_id: UUID, db_session: AsyncSession = Depends(get_db)):
     return await Chapter.find_rel(db_session, chapter_id, Chapter.manga, NotFoundHTTPException("Chapter not found"))
 
 
 @router.get("", response_model=LatestChaptersResponse)
+@cached_response
 async def get_latest_chapters(
     limit: Optional[int] = Query(10, ge=1, le=settings.max_page_limit),
     offset: Optional[int] = Query(0, ge=0),
+    after: Optional[str] = Query(None, description="Cursor of the previous page, replaces the offset"),
     _: Chapter = Permission("view", Chapter.__class_acl__),
+    db_session: AsyncSession = Depends(get_read_db),
+):
+    count, page, cursor = await Chapter.latest(db_session, limit, offset, after)
+    return {
+        "offset": offset,
+        "limit": limit,
+        "results": page,
+        "total": count,
+        "next": cursor,
+    }
+
+
+@router.get("/editable", response_model=LatestChaptersResponse)
+async def get_editable_chapters(
+    limit: Optional[int] = Query(10, ge=1, le=settings.max_page_limit),
+    offset: Optional[int] = Query(0, ge=0),
+    after: Optional[str] = Query(None, description="Cursor of the previous page, replaces the offset"),
+    user_principals=Depends(get_active_principals),
     db_session: AsyncSession = Depends(get_db),
 ):
-    count, page = await Chapter.latest(db_session, limit, offset)
+    """Provides the latest chapters the user can edit."""
+    count, page, cursor = await Chapter.editable(db_session, user_principals, limit, offset, after)
     return {
         "offset": offset,
         "limit": limit,
         "results": page,
         "total": count,
+        "next": cursor,
     }
 
 
 get_responses = {
     200: {
         "description": "The requested chapter",
-        "model": DetailedChapterResponse,
+        "model": ChapterPagesResponse,
     },
     404: {
         "description": "The chapter couldn't be found",
@@ -57,11 +92,76 @@ get_responses = {
 }
 
 
-@router.get("/{chapter_id}", response_model=DetailedChapterResponse, responses=get_responses)
+@router.get("/{chapter_id}", response_model=ChapterPagesResponse, responses=get_responses)
+@cached_response
 async def get_chapter(chapter: Chapter = Permission("view", _get_detailed_chapter)):
     return chapter
 
 
+get_page_responses = {
+    **get_responses,
+    200: {
+        "description": "The requested page",
+        "content": {
+            "image/jpeg": {},
+            "image/webp": {},
+            "image/avif": {},
+        },
+    },
+    404: {
+        "description": "The chapter or the page couldn't be found",
+        **NotFoundHTTPException.open_api("Page not found"),
+    },
+}
+
+
+@router.get("/{chapter_id}/pages/{page}", response_class=Response, responses=get_page_responses)
+async def get_chapter_page(
+    request: Request,
+    page: str = Path(..., regex=PAGE_NAME),
+    chapter: Chapter = Permission("view", _get_chapter),
+):
+    number = int(page.split(".")[0])
+    if not 1 <= number <= chapter.length:
+        raise NotFoundHTTPException("Page not found")
+    return media_response(request, f"{chapter.manga_id}/{chapter.id}/{page}")
+
+
+get_archive_responses = {
+    **get_responses,
+    200: {
+        "description": "The pages of the chapter, in a zip archive without compression",
+        "content": {media_type: {} for media_type in ARCHIVE_MEDIA_TYPES.values()},
+    },
+    206: {
+        "description": "The requested range of the archive",
+        "content": {media_type: {} for media_type in ARCHIVE_MEDIA_TYPES.values()},
+    },
+    416: {
+        "description": "The requested range is outside of the archive",
+    },
+}
+
+
+@router.get("/{chapter_id}/archive", response_class=Response, responses=get_archive_responses)
+async def get_chapter_archive(
+    request: Request,
+    archive_format: str = Query("cbz", alias="format", regex="^(cbz|zip)$"),
+    chapter: Chapter = Permission("view", _get_detailed_chapter),
+):
+    chapter_path = os.path.join(settings.media_path, str(chapter.manga_id), str(chapter.id))
+    # The pages are zero-padded to keep them in order for every reader
+    width = len(str(chapter.length))
+    files = [(f"{n:0{width}}.jpg", os.path.join(chapter_path, f"{n}.jpg")) for n in range(1, chapter.length + 1)]
+    try:
+        archive = StoredZip(files)
+    except FileNotFoundError:
+        raise NotFoundHTTPException("Page not found")
+
+    filename = f"{chapter.manga.title} - {chapter.name}.{archive_format}"
+    return archive_response(request, archive, filename, ARCHIVE_MEDIA_TYPES[archive_format])
+
+
 delete_responses = {
     **auth_responses,
     **get_responses,
@@ -78,10 +178,16 @@ delete_responses = {
 
 @router.delete("/{chapter_id}", responses=delete_responses)
 async def delete_chapter(
-    chapter: Chapter = Permission("edit", _get_chapter), db_session: AsyncSession = Depends(get_db)
+    chapter: Chapter = Permission("edit", _get_chapter),
+    db_session: AsyncSession = Depends(get_db),
 ):
     shutil.rmtree(os.path.join(settings.media_path, str(chapter.manga_id), str(chapter.id)), True)
-    return await chapter.delete(db_session)
+    result = await chapter.delete(db_session)
+    groups_cache.clear()
+    await invalidate_responses()
+    await StoredImage.release(db_session, chapter.pages or [])
+    await StoredImage.collect(db_session)
+    return result
 
 
 put_responses = {
@@ -101,6 +207,8 @@ async def update_chapter(
     db_session: AsyncSession = Depends(get_db),
 ):
     await chapter.update(db_session, **payload.dict())
+    groups_cache.clear()
+    await invalidate_responses()
     return chapter
 
 
@@ -117,17 +225,19 @@ get_comments_responses = {
 async def get_chapter_comments(
     limit: Optional[int] = Query(10, ge=1, le=settings.max_page_limit),
     offset: Optional[int] = Query(0, ge=0),
-    chapter: Chapter = Permission("view", _get_chapter),
+    after: Optional[str] = Query(None, description="Cursor of the previous page, replaces the offset"),
+    chapter: Chapter = Permission("view", _get_read_chapter),
     user_principals=Depends(get_active_principals),
-    db_session: AsyncSession = Depends(get_db),
+    db_session: AsyncSession = Depends(get_read_db),
 ):
     if await has_permission(user_principals, "view", Chapter.__class_acl__()):
-        count, page = await Comment.from_chapter(db_session, chapter.id, limit, offset)
+        count, page, cursor = await Comment.from_chapter(db_session, chapter.id, limit, offset, after)
         return {
             "offset": offset,
             "limit": limit,
             "results": page,
             "total": count,
+            "next": cursor,
         }
     else:
         raise permission_exception
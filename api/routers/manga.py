@@ -3,30 +3,38 @@ import shutil
 from typing import Optional
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, File, Query, UploadFile, status
-from PIL import Image
+from fastapi import APIRouter, BackgroundTasks, Depends, File, Query, UploadFile, status
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..config import get_settings
-from ..db import get_db
+from ..db import get_db, get_read_db
 from ..exceptions import BadRequestHTTPException, NotFoundHTTPException
-from ..fastapi_permissions import has_permission, permission_exception
-from ..models.chapter import Chapter
+from ..fastapi_permissions import filter_permitted
+from ..images import convert_image, run_in_worker, save_variants
+from ..media import get_version
+from ..models.chapter import Chapter, groups_cache
 from ..models.manga import Manga
+from ..models.upload import UploadedBlob, UploadSession
 from ..models.user import User
+from ..response_cache import CachedRoute, cached_response, invalidate_responses
 from ..schemas.chapter import ChapterResponse
 from ..schemas.manga import MangaResponse, MangaSchema, MangaSearchResponse
 from .auth import Permission, auth_responses, get_active_principals, get_connected_user
+from .upload import delete_session_images, release_images
 
 settings = get_settings()
 
-router = APIRouter(prefix="/manga", tags=["Manga"])
+router = APIRouter(prefix="/manga", tags=["Manga"], route_class=CachedRoute)
 
 
 async def _get_manga(manga_id: UUID, db_session: AsyncSession = Depends(get_db)):
     return await Manga.find(db_session, manga_id, NotFoundHTTPException("Manga not found"))
 
 
+async def _get_read_manga(manga_id: UUID, db_session: AsyncSession = Depends(get_read_db)):
+    return await Manga.find(db_session, manga_id, NotFoundHTTPException("Manga not found"))
+
+
 post_responses = {
     **auth_responses,
     201: {
@@ -50,24 +58,28 @@ async def create_manga(
 ):
     manga = Manga(**payload.dict(), owner_id=user.id)
     await manga.save(db_session)
+    await invalidate_responses()
     os.mkdir(os.path.join(settings.media_path, str(manga.id)))
     return manga
 
 
 @router.get("", response_model=MangaSearchResponse)
+@cached_response
 async def search_manga(
     title: str = "",
     limit: Optional[int] = Query(10, ge=1, le=settings.max_page_limit),
     offset: Optional[int] = Query(0, ge=0),
+    after: Optional[str] = Query(None, description="Cursor of the previous page, replaces the offset"),
     _: Manga = Permission("view", Manga.__class_acl__),
-    db_session: AsyncSession = Depends(get_db),
+    db_session: AsyncSession = Depends(get_read_db),
 ):
-    count, page = await Manga.search(db_session, title, limit, offset)
+    count, page, cursor = await Manga.search(db_session, title, limit, offset, after)
     return {
         "offset": offset,
         "limit": limit,
         "results": page,
         "total": count,
+        "next": cursor,
     }
 
 
@@ -84,6 +96,7 @@ get_responses = {
 
 
 @router.get("/{manga_id}", response_model=MangaResponse, responses=get_responses)
+@cached_response
 async def get_manga(manga: Manga = Permission("view", _get_manga)):
     return manga
 
@@ -98,15 +111,14 @@ get_chapters_responses = {
 
 
 @router.get("/{manga_id}/chapters", response_model=list[ChapterResponse], responses=get_chapters_responses)
+@cached_response
 async def get_manga_chapters(
-    manga: Manga = Permission("view", _get_manga),
+    manga: Manga = Permission("view", _get_read_manga),
     user_principals=Depends(get_active_principals),
-    db_session: AsyncSession = Depends(get_db),
+    db_session: AsyncSession = Depends(get_read_db),
 ):
-    if await has_permission(user_principals, "view", Chapter.__class_acl__()):
-        return await Chapter.from_manga(db_session, manga.id)
-    else:
-        raise permission_exception
+    # The chapters all share the class ACL, it's checked once for the whole list
+    return await filter_permitted(user_principals, "view", await Chapter.from_manga(db_session, manga.id))
 
 
 delete_responses = {
@@ -124,9 +136,21 @@ delete_responses = {
 
 
 @router.delete("/{manga_id}", responses=delete_responses)
-async def delete_manga(manga: Manga = Permission("edit", _get_manga), db_session: AsyncSession = Depends(get_db)):
+async def delete_manga(
+    tasks: BackgroundTasks,
+    manga: Manga = Permission("edit", _get_manga),
+    db_session: AsyncSession = Depends(get_db),
+):
+    # The chapters and sessions are deleted by the database, so their references are released here
+    pages = await Chapter.pages_of_manga(db_session, manga.id)
+    blobs = await UploadedBlob.from_sessions(db_session, UploadSession.manga_id == manga.id)
     shutil.rmtree(os.path.join(settings.media_path, str(manga.id)))
-    return await manga.delete(db_session)
+    result = await manga.delete(db_session)
+    groups_cache.clear()
+    await invalidate_responses()
+    await release_images(db_session, [*pages, *(b.hash for b in blobs)])
+    tasks.add_task(delete_session_images, [b.id for b in blobs])
+    return result
 
 
 put_responses = {
@@ -146,12 +170,17 @@ async def update_manga(
     db_session: AsyncSession = Depends(get_db),
 ):
     await manga.update(db_session, **payload.dict())
+    await invalidate_responses()
     return manga
 
 
-def save_cover(manga_id: UUID, file: File):
-    im = Image.open(file)
-    im.convert("RGB").save(os.path.join(settings.media_path, str(manga_id), "cover.jpg"))
+async def save_cover(manga_id: UUID, file: UploadFile) -> str:
+    """Saves the cover and its variants, returns its version"""
+    content = await file.read()
+    cover_path = os.path.join(settings.media_path, str(manga_id), "cover.jpg")
+    await run_in_worker(convert_image, content, cover_path)
+    await run_in_worker(save_variants, cover_path)
+    return get_version(os.stat(cover_path))
 
 
 put_cover_responses = {
@@ -168,7 +197,7 @@ put_cover_responses = {
 }
 
 
-@router.put("/{manga_id}/cover", responses=put_cover_responses)
+@router.put("/{manga_id}/cover", response_model=MangaResponse, responses=put_cover_responses)
 async def set_manga_cover(
     payload: UploadFile = File(...),
     manga: Manga = Permission("edit", _get_manga),
@@ -177,7 +206,8 @@ async def set_manga_cover(
     if not payload.content_type.startswith("image/"):
         raise BadRequestHTTPException(f"'{payload.filename}' is not an image")
 
-    save_cover(manga.id, payload.file)
-    await manga.save(db_session)
+    cover_version = await save_cover(manga.id, payload)
+    await manga.update(db_session, cover_version=cover_version)
+    await invalidate_responses()
 
     return manga
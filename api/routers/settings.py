@@ -3,7 +3,7 @@ from fastapi import APIRouter
 from ..config import get_settings
 from ..models.settings import Settings
 from ..schemas.settings import SettingsSchema
-from .auth import Permission, auth_responses
+from .auth import Permission, VerifiedPermission, auth_responses
 
 global_settings = get_settings()
 
@@ -31,7 +31,10 @@ put_responses = {
 
 
 @router.put(
-    "", response_model=SettingsSchema, dependencies=[Permission("edit", custom_settings)], responses=put_responses
+    "",
+    response_model=SettingsSchema,
+    dependencies=[VerifiedPermission("edit", custom_settings)],
+    responses=put_responses,
 )
 async def edit_site_settings(settings: SettingsSchema):
     return custom_settings.set(settings)
@@ -1,13 +1,15 @@
+import asyncio
+import logging
 import shutil
 from os import listdir, makedirs, path, remove
-from typing import Iterable
+from typing import Iterable, Optional
 from uuid import UUID
+from zipfile import ZipFile, is_zipfile
 
 from aiofiles import open
-from fastapi import APIRouter, BackgroundTasks, Depends, File, UploadFile, status
+from fastapi import APIRouter, BackgroundTasks, Depends, File, Query, UploadFile, status
 from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse
-from PIL import Image
 from pyunpack import Archive
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -15,23 +17,62 @@ from ..config import get_settings
 from ..db import get_db
 from ..exceptions import BadRequestHTTPException, NotFoundHTTPException
 from ..fastapi_permissions import has_permission, permission_exception
-from ..models.chapter import Chapter
+from ..images import (
+    concat_and_cut_images,
+    run_in_worker,
+    save_variants,
+    store_archive_member,
+    store_image,
+    variant_suffixes,
+)
+from ..models.chapter import Chapter, groups_cache
+from ..models.image import StoredImage
 from ..models.manga import Manga
 from ..models.upload import UploadedBlob, UploadSession
 from ..models.user import User
+from ..response_cache import invalidate_responses
 from ..schemas.chapter import ChapterResponse
-from ..schemas.upload import CommitUploadSession, UploadedBlobResponse, UploadSessionResponse, UploadSessionSchema
+from ..schemas.upload import (
+    CommitUploadSession,
+    UploadedBlobResponse,
+    UploadSessionResponse,
+    UploadSessionSchema,
+    UploadSessionsResponse,
+)
+from ..storage import get_object_path, ingest_file, link_object, staged_digest, store_objects
 from .auth import Permission, auth_responses, get_active_principals, is_connected
 
 global_settings = get_settings()
 
+log = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/upload", tags=["Upload"])
 
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
 
 def get_blob_path(blob_id: UUID):
     return path.join(global_settings.media_path, "blobs", f"{blob_id}.jpg")
 
 
+async def create_session_blobs(
+    db_session: AsyncSession, session_id: UUID, names: list[str], digests: list[str], staged: Iterable[str] = ()
+):
+    rows = [{"session_id": session_id, "name": name, "hash": digest} for name, digest in zip(names, digests)]
+    blobs = await UploadedBlob.save_all(db_session, rows)
+    await StoredImage.acquire(db_session, digests)
+    # The staged images are only stored once they're referenced, so they can't be collected in between
+    store_objects(staged)
+    for blob in blobs:
+        link_object(blob.hash, get_blob_path(blob.id))
+    return blobs
+
+
+async def release_images(db_session: AsyncSession, digests: Iterable[str]):
+    await StoredImage.release(db_session, (d for d in digests if d))
+    await StoredImage.collect(db_session)
+
+
 async def _get_upload_session(session_id: UUID, db_session: AsyncSession = Depends(get_db)):
     return await UploadSession.find(db_session, session_id, NotFoundHTTPException("Session not found"))
 
@@ -42,11 +83,18 @@ async def _get_upload_session_blobs(session_id: UUID, db_session: AsyncSession =
     )
 
 
-def copy_chapter_to_session(chapter: Chapter, blobs: list[UUID]):
-    chapter_path = path.join(global_settings.media_path, str(chapter.manga_id), str(chapter.id))
-    blob_path = path.join(global_settings.media_path, "blobs")
-    for i in range(chapter.length):
-        shutil.copy(path.join(chapter_path, f"{i + 1}.jpg"), path.join(blob_path, f"{blobs[i]}.jpg"))
+async def get_chapter_pages(db_session: AsyncSession, chapter: Chapter):
+    """Returns the hashes of the chapter's pages, adding them to the store if they weren't yet."""
+    if chapter.pages is None:
+        chapter_path = path.join(global_settings.media_path, str(chapter.manga_id), str(chapter.id))
+        files = (path.join(chapter_path, f"{i + 1}.jpg") for i in range(chapter.length))
+        staged = await asyncio.gather(*(run_in_worker(ingest_file, file) for file in files))
+        pages = [staged_digest(staged_path) for staged_path in staged]
+        await StoredImage.acquire(db_session, pages)
+        store_objects(staged)
+        chapter.pages = pages
+        await db_session.commit()
+    return chapter.pages
 
 
 post_responses = {
@@ -94,16 +142,38 @@ async def begin_upload_session(
     makedirs(path.join(session_path, "files"))
 
     if chapter:
-        blobs = []
-        for i in range(1, chapter.length + 1):
-            blob = UploadedBlob(session_id=session.id, name=f"{i}.jpg")
-            await blob.save(db_session)
-            blobs.append(blob.id)
-        copy_chapter_to_session(chapter, blobs)
+        pages = await get_chapter_pages(db_session, chapter)
+        await create_session_blobs(db_session, session.id, [f"{i + 1}.jpg" for i in range(len(pages))], pages)
 
     return await UploadSession.find_rel(db_session, session.id, UploadSession.blobs)
 
 
+get_all_responses = {
+    **auth_responses,
+    200: {
+        "description": "The upload sessions the user can edit",
+        "model": UploadSessionsResponse,
+    },
+}
+
+
+@router.get("", response_model=UploadSessionsResponse, responses=get_all_responses)
+async def get_upload_sessions(
+    limit: Optional[int] = Query(10, ge=1, le=global_settings.max_page_limit),
+    offset: Optional[int] = Query(0, ge=0),
+    user_principals=Depends(get_active_principals),
+    db_session: AsyncSession = Depends(get_db),
+):
+    """Provides the upload sessions the user can edit."""
+    count, page = await UploadSession.editable(db_session, user_principals, limit, offset)
+    return {
+        "offset": offset,
+        "limit": limit,
+        "results": page,
+        "total": count,
+    }
+
+
 get_responses = {
     **auth_responses,
     404: {
@@ -122,11 +192,11 @@ async def get_upload_session(session=Permission("view", _get_upload_session_blob
     return session
 
 
-def save_session_image(files: Iterable[tuple[UUID, str]]):
-    for blob_id, file in files:
-        im = Image.open(file)
-        im.convert("RGB").save(get_blob_path(blob_id))
+async def store_session_images(files: list[str]):
+    staged = await asyncio.gather(*(run_in_worker(store_image, file) for file in files))
+    for file in files:
         remove(file)
+    return staged
 
 
 post_blobs_responses = {
@@ -148,6 +218,16 @@ def validate_image_extension(name: str):
     return any(name.lower().endswith(ext) for ext in extensions)
 
 
+def validate_archive_member(name: str):
+    return not name.endswith("/") and not name.startswith("__MACOSX/") and validate_image_extension(name)
+
+
+async def write_upload_file(file: UploadFile, file_path: str):
+    async with open(file_path, "wb") as out_file:
+        while content := await file.read(UPLOAD_CHUNK_SIZE):
+            await out_file.write(content)
+
+
 @router.post(
     "/{session_id}",
     status_code=status.HTTP_201_CREATED,
@@ -176,34 +256,43 @@ async def upload_pages_to_upload_session(
 
     files_path = path.join(session_path, "files")
 
-    blobs = []
+    names, staged, images = [], [], []
     for file in payload:
         if file.content_type in compressed_formats:
             zip_path = path.join(session_path, f"zip/{file.filename}")
-            async with open(zip_path, "wb") as out_file:
-                content = await file.read()
-                await out_file.write(content)
-
-            Archive(zip_path).extractall(files_path, True)
+            await write_upload_file(file, zip_path)
+
+            if is_zipfile(zip_path):
+                with ZipFile(zip_path) as archive:
+                    members = [m for m in archive.namelist() if validate_archive_member(m)]
+                names.extend(path.basename(m) for m in members)
+                staged.extend(
+                    await asyncio.gather(*(run_in_worker(store_archive_member, zip_path, m) for m in members))
+                )
+            else:
+                # Extracted apart from the uploaded images, which are only converted once they're all written
+                extract_path = f"{zip_path}.files"
+                Archive(zip_path).extractall(extract_path, True)
+                _files = listdir(extract_path)
+                _names = [f for f in _files if path.isfile(path.join(extract_path, f)) and validate_image_extension(f)]
+                names.extend(_names)
+                staged.extend(await store_session_images([path.join(extract_path, f) for f in _names]))
+                shutil.rmtree(extract_path, True)
             remove(zip_path)
-            _files = listdir(files_path)
-            files = [f for f in _files if path.isfile(path.join(files_path, f)) and validate_image_extension(f)]
         else:
-            async with open(path.join(files_path, file.filename), "wb") as out_file:
-                content = await file.read()
-                await out_file.write(content)
-            files = (file.filename,)
+            file_path = path.join(files_path, f"{len(staged)}-{file.filename}")
+            await write_upload_file(file, file_path)
+            images.append((len(staged), file_path))
+            names.append(file.filename)
+            staged.append(None)
 
-        file_blobs = []
-        for f in files:
-            file_blob = UploadedBlob(session_id=session.id, name=f)
-            await file_blob.save(db_session)
-            blobs.append(file_blob)
-            file_blobs.append(file_blob.id)
+    # The uploaded images are converted together, across all the workers
+    staged_images = await store_session_images([file_path for _, file_path in images])
+    for (i, _), staged_path in zip(images, staged_images):
+        staged[i] = staged_path
 
-        save_session_image(zip(file_blobs, (path.join(files_path, f) for f in files)))
-
-    return blobs
+    # And the blobs of the whole request are created at once
+    return await create_session_blobs(db_session, session.id, names, [staged_digest(p) for p in staged], staged)
 
 
 def delete_session_images(ids: list[UUID]):
@@ -230,26 +319,41 @@ async def delete_upload_session(
     session=Permission("edit", _get_upload_session_blobs),
     db_session: AsyncSession = Depends(get_db),
 ):
-    session_images = (b.id for b in session.blobs)
+    session_images = [b.id for b in session.blobs]
+    digests = [b.hash for b in session.blobs]
     await session.delete(db_session)
+    await release_images(db_session, digests)
     session_path = path.join(global_settings.temp_path, str(session.id))
     tasks.add_task(shutil.rmtree, session_path, True)
     tasks.add_task(delete_session_images, session_images)
     return "OK"
 
 
-def commit_session_images(chapter: Chapter, pages: list[UUID], edit: bool):
-    blob_path = path.join(global_settings.media_path, "blobs")
+async def commit_session_images(chapter: Chapter, pages: list[str], edit: bool):
     chapter_path = path.join(global_settings.media_path, str(chapter.manga_id), str(chapter.id))
-
     if edit:
         shutil.rmtree(chapter_path, True)
     makedirs(chapter_path, exist_ok=True)
 
-    page_number = 1
-    for page in pages:
-        shutil.move(path.join(blob_path, f"{page}.jpg"), path.join(chapter_path, f"{page_number}.jpg"))
-        page_number += 1
+    for page_number, page in enumerate(pages, 1):
+        link_object(page, path.join(chapter_path, f"{page_number}.jpg"))
+
+    # The variants are optional, the chapter can be read without the ones that couldn't be encoded
+    unique_pages = list(set(pages))
+    results = await asyncio.gather(
+        *(run_in_worker(save_variants, get_object_path(page), False) for page in unique_pages), return_exceptions=True
+    )
+    failed = set()
+    for page, result in zip(unique_pages, results):
+        if isinstance(result, Exception):
+            log.warning("Couldn't save the variants of %s: %r", page, result)
+            failed.add(page)
+
+    suffixes = variant_suffixes()
+    for page_number, page in enumerate(pages, 1):
+        for suffix in suffixes:
+            if page not in failed or path.exists(get_object_path(page, suffix)):
+                link_object(page, path.join(chapter_path, f"{page_number}{suffix}"), suffix)
 
 
 post_commit_responses = {
@@ -280,32 +384,40 @@ async def commit_upload_session(
     session=Permission("edit", _get_upload_session_blobs),
     db_session: AsyncSession = Depends(get_db),
 ):
-    blobs = [b.id for b in session.blobs]
+    blobs = {b.id: b.hash for b in session.blobs}
     edit = session.chapter_id is not None
     if not len(payload.page_order) > 0:
         raise BadRequestHTTPException("At least one page needs to be provided")
     if len(set(payload.page_order).difference(blobs)) > 0:
         raise BadRequestHTTPException("Some pages don't belong to this session")
 
+    pages = [blobs[page] for page in payload.page_order]
     if session.chapter_id:
         chapter = await Chapter.find(db_session, session.chapter_id, NotFoundHTTPException("Chapter not found"))
-        await chapter.update(db_session, length=len(payload.page_order), **payload.chapter_draft.dict())
+        old_pages = chapter.pages or []
+        await chapter.update(db_session, length=len(pages), pages=pages, **payload.chapter_draft.dict())
     else:
+        old_pages = []
         chapter = Chapter(
             manga_id=session.manga_id,
-            length=len(payload.page_order),
+            length=len(pages),
+            pages=pages,
             owner_id=session.owner_id,
             **payload.chapter_draft.dict(),
         )
         await chapter.save(db_session)
+    groups_cache.clear()
+    await invalidate_responses()
 
     session_path = path.join(global_settings.temp_path, str(session.id))
     tasks.add_task(shutil.rmtree, session_path, True)
 
+    await StoredImage.acquire(db_session, pages)
     await session.delete(db_session)
+    await release_images(db_session, [*old_pages, *blobs.values()])
 
-    tasks.add_task(commit_session_images, chapter, payload.page_order, edit)
-    tasks.add_task(delete_session_images, set(blobs).difference(payload.page_order))
+    tasks.add_task(commit_session_images, chapter, pages, edit)
+    tasks.add_task(delete_session_images, blobs.keys())
     content = jsonable_encoder(ChapterResponse.from_orm(chapter))
     return JSONResponse(status_code=(200 if edit else 201), content=content)
 
@@ -329,12 +441,11 @@ async def delete_all_pages_from_upload_session(
     session=Permission("edit", _get_upload_session_blobs),
     db_session: AsyncSession = Depends(get_db),
 ):
-    session_images = (b.id for b in session.blobs)
+    session_images = [b.id for b in session.blobs]
     tasks.add_task(delete_session_images, session_images)
 
-    for blob in session.blobs:
-        await blob.delete(db_session)
-
+    await UploadedBlob.delete_where(db_session, UploadedBlob.session_id == session.id)
+    await release_images(db_session, (b.hash for b in session.blobs))
     return "OK"
 
 
@@ -362,39 +473,16 @@ async def delete_page_from_upload_session(
     session=Permission("edit", _get_upload_session_blobs),
     db_session: AsyncSession = Depends(get_db),
 ):
-    if file_id not in (b.id for b in session.blobs):
+    blob = next((b for b in session.blobs if b.id == file_id), None)
+    if not blob:
         raise BadRequestHTTPException("The blob doesn't exist in the session")
 
-    blob = await UploadedBlob.find(db_session, file_id, NotFoundHTTPException("Blob not found"))
-    await blob.delete(db_session)
+    await UploadedBlob.delete_where(db_session, UploadedBlob.id == file_id)
+    await release_images(db_session, (blob.hash,))
     tasks.add_task(delete_session_images, (file_id,))
     return "OK"
 
 
-def concat_and_cut_images(blob_ids: Iterable[UUID]):
-    images = [Image.open(get_blob_path(blob_id)) for blob_id in blob_ids]
-    height = sum(image.height for image in images)
-
-    if not all(images[0].width == image.width for image in images):
-        raise BadRequestHTTPException("All the images should have the same width")
-
-    joined = Image.new("RGB", (images[0].width, height))
-    running_height = 0
-    for image in images:
-        joined.paste(image, (0, running_height))
-        image.close()
-        running_height += image.height
-
-    amount_parts = joined.height // (2 * joined.width) + 1
-    parts = []
-    for i in range(amount_parts):
-        end_y = min(height, 2 * joined.width * (i + 1))
-        part = joined.crop((0, 2 * joined.width * i, joined.width, end_y))
-        parts.append(part)
-
-    return parts
-
-
 slice_blobs_responses = {
     **auth_responses,
     400: {
@@ -424,24 +512,23 @@ async def slice_pages_in_upload_session(
     session=Permission("edit", _get_upload_session_blobs),
     db_session: AsyncSession = Depends(get_db),
 ):
-    blobs = [b.id for b in session.blobs]
+    blobs = {b.id: b.hash for b in session.blobs}
 
     if not len(payload) > 0:
         raise BadRequestHTTPException("At least one page needs to be provided")
     if len(set(payload).difference(blobs)) > 0:
         raise BadRequestHTTPException("Some pages don't belong to this session")
 
-    parts = concat_and_cut_images(payload)
+    try:
+        parts = await run_in_worker(concat_and_cut_images, [get_blob_path(b) for b in payload])
+    except ValueError as e:
+        raise BadRequestHTTPException(str(e))
 
-    for i, part in enumerate(parts):
-        file_blob = UploadedBlob(session_id=session.id, name=f"slice_{i+1}.jpg")
-        await file_blob.save(db_session)
-        part.save(get_blob_path(file_blob.id))
-        part.close()
+    names = [f"slice_{i + 1}.jpg" for i in range(len(parts))]
+    await create_session_blobs(db_session, session.id, names, [staged_digest(p) for p in parts], parts)
 
-    for blob_id in payload:
-        blob: UploadedBlob = await UploadedBlob.find(db_session, blob_id)
-        await blob.delete(db_session)
+    await UploadedBlob.delete_where(db_session, UploadedBlob.session_id == session.id, UploadedBlob.id.in_(payload))
+    await release_images(db_session, (blobs[b] for b in payload))
 
     tasks.add_task(delete_session_images, payload)
 
@@ -2,8 +2,7 @@ from os import path
 from typing import Optional
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, File, Query, Request, UploadFile, status
-from PIL import Image
+from fastapi import APIRouter, BackgroundTasks, Depends, File, Query, Request, UploadFile, status
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..app import limiter
@@ -11,9 +10,13 @@ from ..config import get_settings
 from ..db import get_db
 from ..exceptions import BadRequestHTTPException, NotFoundHTTPException
 from ..fastapi_permissions import has_permission
+from ..images import convert_image, run_in_worker, save_variants
+from ..models.upload import UploadedBlob, UploadSession
 from ..models.user import Role, User
-from ..schemas.user import UserFilters, UserRegisterSchema, UserResponse, UserSchema, UsersResponse
-from .auth import Permission, auth_responses, get_active_principals, get_password_hash, is_connected
+from ..passwords import hash_password, verify_password
+from ..schemas.user import UserFilters, UserRegisterSchema, UserResponse, UserSchema, UsersResponse, UserUpdateSchema
+from .auth import Permission, VerifiedPermission, auth_responses, get_verified_principals, is_connected, user_cache
+from .upload import delete_session_images, release_images
 
 settings = get_settings()
 
@@ -76,13 +79,11 @@ put_responses = {
 
 @router.put("/{user_id}", response_model=UserResponse, responses=put_responses)
 async def update_user(
-    payload: UserSchema,
-    user: User = Permission("edit", _get_user),
-    user_principals=Depends(get_active_principals),
+    payload: UserUpdateSchema,
+    user: User = VerifiedPermission("edit", _get_user),
+    user_principals=Depends(get_verified_principals),
     db_session: AsyncSession = Depends(get_db),
 ):
-    hashed_pwd = get_password_hash(payload.password)
-
     if await User.from_username_email(db_session, payload.username, payload.email, user.id):
         raise BadRequestHTTPException("That username or email is already in use")
 
@@ -92,7 +93,12 @@ async def update_user(
     if not await has_permission(user_principals, "edit", User.__class_acl__()):
         data.pop("role")
 
-    await user.update(db_session, **data, hashed_password=hashed_pwd)
+    # The clients resending the current password don't need a new hash
+    if payload.password is not None and not await verify_password(payload.password, user.hashed_password):
+        data["hashed_password"] = await hash_password(payload.password)
+
+    await user.update(db_session, **data)
+    user_cache.delete(user.id)
 
     return user
 
@@ -115,8 +121,18 @@ delete_responses = {
 
 
 @router.delete("/{user_id}", responses=delete_responses)
-async def delete_user(user: User = Permission("edit", _get_user), db_session: AsyncSession = Depends(get_db)):
-    return await user.delete(db_session)
+async def delete_user(
+    tasks: BackgroundTasks,
+    user: User = VerifiedPermission("edit", _get_user),
+    db_session: AsyncSession = Depends(get_db),
+):
+    # The upload sessions are deleted by the database, so the references of their blobs are released here
+    blobs = await UploadedBlob.from_sessions(db_session, UploadSession.owner_id == user.id)
+    result = await user.delete(db_session)
+    user_cache.delete(user.id)
+    await release_images(db_session, (b.hash for b in blobs))
+    tasks.add_task(delete_session_images, [b.id for b in blobs])
+    return result
 
 
 post_responses = {
@@ -135,10 +151,10 @@ post_responses = {
 @router.post("", response_model=UserResponse, status_code=status.HTTP_201_CREATED, responses=post_responses)
 async def create_user(
     payload: UserSchema,
-    _: User = Permission("create", User.__class_acl__),
+    _: User = VerifiedPermission("create", User.__class_acl__),
     db_session: AsyncSession = Depends(get_db),
 ):
-    hashed_pwd = get_password_hash(payload.password)
+    hashed_pwd = await hash_password(payload.password)
 
     if await User.from_username_email(db_session, payload.username, payload.email):
         raise BadRequestHTTPException("That username or email is already in use")
@@ -173,7 +189,7 @@ if settings.allow_registration:
         _: User = Permission("register", User.__class_acl__),
         db_session: AsyncSession = Depends(get_db),
     ):
-        hashed_pwd = get_password_hash(payload.password)
+        hashed_pwd = await hash_password(payload.password)
 
         if await User.from_username_email(db_session, payload.username, payload.email):
             raise BadRequestHTTPException("That username or email is already in use")
@@ -218,9 +234,11 @@ async def search_users(
     }
 
 
-def save_avatar(user_id: UUID, file: File):
-    im = Image.open(file)
-    im.convert("RGB").save(path.join(settings.media_path, "users", f"{user_id}.jpg"))
+async def save_avatar(user_id: UUID, file: UploadFile):
+    content = await file.read()
+    avatar_path = path.join(settings.media_path, "users", f"{user_id}.jpg")
+    await run_in_worker(convert_image, content, avatar_path)
+    await run_in_worker(save_variants, avatar_path)
 
 
 put_avatar_responses = {
@@ -245,7 +263,8 @@ async def set_avatar(
     if not payload.content_type.startswith("image/"):
         raise BadRequestHTTPException(f"'{payload.filename}' is not an image")
 
-    save_avatar(user.id, payload.file)
+    await save_avatar(user.id, payload)
     await user.save(db_session)
+    user_cache.delete(user.id)
 
     return user
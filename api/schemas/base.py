@@ -1,3 +1,5 @@
+from typing import Optional
+
 from fastapi_camelcase import CamelModel
 from pydantic import Field
 
@@ -10,7 +12,8 @@ class PaginationResponse(CamelModel):
     offset: int = Field(..., ge=0)
     limit: int = Field(..., ge=1, le=settings.max_page_limit)
     results: list
-    total: int = Field(..., ge=0)
+    total: Optional[int] = Field(..., ge=0, description="Amount of results, can be estimated or missing")
+    next: Optional[str] = Field(None, description="Cursor of the next page, to use as `after`")
 
     class Config:
         orm_mode = True
@@ -3,7 +3,7 @@ from typing import Optional
 from uuid import UUID
 
 from fastapi_camelcase import CamelModel
-from pydantic import Field
+from pydantic import Field, validator
 
 from .base import PaginationResponse
 from .manga import MangaResponse
@@ -73,5 +73,18 @@ class DetailedChapterResponse(ChapterResponse):
     manga: MangaResponse
 
 
+class ChapterPagesResponse(DetailedChapterResponse):
+    pages: Optional[list[str]] = Field(
+        description="Versioned paths of the pages, they can be cached indefinitely (null until the pages are stored)"
+    )
+
+    @validator("pages")
+    def versioned_pages(cls, pages, values):
+        if pages is None or "id" not in values or "manga_id" not in values:
+            return None
+        chapter_path = f"/media/{values['manga_id']}/{values['id']}"
+        return [f"{chapter_path}/{number}.jpg?v={digest}" for number, digest in enumerate(pages, 1)]
+
+
 class LatestChaptersResponse(PaginationResponse):
     results: list[DetailedChapterResponse]
@@ -52,6 +52,7 @@ class MangaResponse(MangaSchema):
         description="Time this manga was created",
     )
     owner_id: Optional[UUID] = Field(description="User that created this manga")
+    cover: Optional[str] = Field(description="Versioned path of the cover, it can be cached indefinitely")
 
     class Config:
         orm_mode = True
@@ -67,6 +68,7 @@ class MangaResponse(MangaSchema):
                 "version": 2,
                 "createTime": "2000-08-24 00:00:00",
                 "ownerId": "6901d7f6-c4e1-4200-9dd0-a6fccc065978",
+                "cover": "/media/1e01d7f6-c4e1-4102-9dd0-a6fccc065978/cover.jpg?v=4e1a2-2b5c-16b9dd7e5c5e0f00",
             }
         }
 
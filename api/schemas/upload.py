@@ -4,6 +4,7 @@ from uuid import UUID
 from fastapi_camelcase import CamelModel
 from pydantic import Field
 
+from .base import PaginationResponse
 from .chapter import ChapterSchema
 
 
@@ -54,6 +55,10 @@ class UploadSessionResponse(UploadSessionSchema):
         orm_mode = True
 
 
+class UploadSessionsResponse(PaginationResponse):
+    results: list[UploadSessionResponse]
+
+
 class CommitUploadSession(CamelModel):
     chapter_draft: ChapterSchema = Field(description="Details of the chapter")
     page_order: list[UUID] = Field(description="Order the pages should be uploaded in")
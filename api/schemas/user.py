@@ -14,6 +14,8 @@ class TokenContent(CamelModel):
     sub: str
     exp: datetime
     iat: datetime
+    role: Optional[Role] = None
+    ver: Optional[int] = None
 
     def dict(self, *args, **kwargs):
         return {**super().dict(*args, **kwargs), "nbf": self.iat}
@@ -45,6 +47,11 @@ class UserSchema(UserRegisterSchema):
     role: Role = Field(description="Role of the user")
 
 
+class UserUpdateSchema(User):
+    password: Optional[str] = Field(None, description="New password of the user, the current one is kept if missing")
+    role: Role = Field(description="Role of the user")
+
+
 class UserResponse(User):
     id: UUID = Field(title="ID", description="ID of the user")
     version: int = Field(description="Version of the user")
@@ -0,0 +1,87 @@
+import shutil
+from glob import glob
+from hashlib import sha256
+from os import link, makedirs, path, remove, replace
+from typing import Iterable
+from uuid import uuid4
+
+from .config import get_settings
+
+global_settings = get_settings()
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def get_object_path(digest: str, suffix: str = ".jpg"):
+    return path.join(global_settings.media_path, "objects", digest[:2], f"{digest}{suffix}")
+
+
+def link_file(source: str, destination: str):
+    """Hardlinks the file, or copies it if the filesystem doesn't allow it.
+    Stored objects are shared by every file linked to them, so those files must never be written in place.
+    """
+    try:
+        link(source, destination)
+    except FileExistsError:
+        raise
+    except OSError:
+        shutil.copy(source, destination)
+
+
+def link_object(digest: str, destination: str, suffix: str = ".jpg"):
+    link_file(get_object_path(digest, suffix), destination)
+
+
+def get_staging_path(digest: str):
+    return path.join(global_settings.media_path, "objects", "staging", f"{uuid4()}.{digest}")
+
+
+def staged_digest(staged_path: str) -> str:
+    return staged_path.rsplit(".", 1)[1]
+
+
+def write_object(content: bytes) -> str:
+    """Writes the content to the staging folder and returns its staged path.
+    The object is only stored by store_objects, once it's referenced, so it can't be collected in between.
+    """
+    staged_path = get_staging_path(sha256(content).hexdigest())
+    makedirs(path.dirname(staged_path), exist_ok=True)
+    with open(staged_path, "wb") as file:
+        file.write(content)
+    return staged_path
+
+
+def ingest_file(file_path: str) -> str:
+    """Stages an existing file by linking it, and returns its staged path."""
+    file_hash = sha256()
+    with open(file_path, "rb") as file:
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            file_hash.update(chunk)
+
+    staged_path = get_staging_path(file_hash.hexdigest())
+    makedirs(path.dirname(staged_path), exist_ok=True)
+    link_file(file_path, staged_path)
+    return staged_path
+
+
+def store_objects(staged_paths: Iterable[str]):
+    """Moves the staged objects to the store, unless an identical one is already stored.
+    Their images must have been acquired beforehand.
+    """
+    for staged_path in staged_paths:
+        object_path = get_object_path(staged_digest(staged_path))
+        if path.exists(object_path):
+            remove(staged_path)
+        else:
+            makedirs(path.dirname(object_path), exist_ok=True)
+            replace(staged_path, object_path)
+
+
+def remove_objects(digests: Iterable[str]):
+    """Removes the stored images, along with their variants."""
+    for digest in digests:
+        for object_path in glob(get_object_path(digest, ".*")):
+            try:
+                remove(object_path)
+            except FileNotFoundError:
+                pass
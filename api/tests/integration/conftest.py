@@ -1,9 +1,15 @@
 import asyncio
 from datetime import timedelta
+from io import BytesIO
+from typing import Optional
+from uuid import uuid4
 
 import pytest
+from fastapi import status
 from httpx import AsyncClient
+from PIL import Image
 
+from api.app import setup_media
 from api.main import app
 from api.routers.auth import create_token
 
@@ -19,6 +25,9 @@ def event_loop():
 
 @pytest.fixture(scope="session")
 async def client():
+    # The whole suite creates more manga than the default limit of the endpoints allows per minute
+    app.state.limiter.enabled = False
+    await setup_media()
     async with AsyncClient(app=app, base_url="http://monochrome.test") as c:
         yield c
 
@@ -31,3 +40,61 @@ def token():
 @pytest.fixture(scope="session")
 def headers(token):
     return dict(Authorization=token)
+
+
+@pytest.fixture
+def manga_draft():
+    return {
+        "title": "Monochrome Lovers",
+        "description": "One day, suddenly, an angel came descending from the sky!?",
+        "author": "Hibiki Mio",
+        "artist": "Hibiki Mio",
+        "year": 2021,
+        "status": "ongoing",
+    }
+
+
+@pytest.fixture
+def chapter_draft():
+    return {"name": "Chapter", "volume": 1, "number": 1, "webtoon": False, "scanGroup": "no group"}
+
+
+@pytest.fixture
+def image_file():
+    def make_image(name: str, width: int = 100, height: int = 150, fmt: str = "PNG", color="white"):
+        content = BytesIO()
+        Image.new("RGB", (width, height), color).save(content, fmt)
+        return "payload", (name, content.getvalue(), f"image/{fmt.lower()}")
+
+    return make_image
+
+
+@pytest.fixture
+def create_user(client: AsyncClient, headers: dict):
+    async def create(role: str = "user"):
+        body = {"username": f"u{uuid4().hex[:12]}", "email": None, "password": "password", "role": role}
+        response = await client.post("/user", json=body, headers=headers)
+        assert response.status_code == status.HTTP_201_CREATED
+        user_id = response.json()["id"]
+        return body, user_id, {"Authorization": "Bearer " + create_token(sub=user_id, typ="session")}
+
+    return create
+
+
+@pytest.fixture
+def create_chapter(client: AsyncClient, headers: dict, manga_draft: dict, chapter_draft: dict, image_file):
+    async def create(owner_headers: Optional[dict] = None, pages: int = 2, **draft):
+        owner_headers = owner_headers or headers
+        response = await client.post("/manga", json=manga_draft, headers=owner_headers)
+        manga_id = response.json()["id"]
+        response = await client.post("/upload/begin", json={"mangaId": manga_id}, headers=owner_headers)
+        session_id = response.json()["id"]
+
+        files = [image_file(f"{i + 1}.png") for i in range(pages)]
+        response = await client.post(f"/upload/{session_id}", files=files, headers=owner_headers)
+        body = {"chapterDraft": {**chapter_draft, **draft}, "pageOrder": [b["id"] for b in response.json()]}
+        response = await client.post(f"/upload/{session_id}/commit", json=body, headers=owner_headers)
+        assert response.status_code == status.HTTP_201_CREATED
+        return response.json()
+
+    return create
@@ -0,0 +1,122 @@
+from datetime import timedelta
+
+import pytest
+from fastapi import status
+from httpx import AsyncClient
+from sqlalchemy import event, exc, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from api import db, response_cache
+from api.cache import MemoryBackend
+from api.config import get_settings
+from api.db import PgBouncerConnection, make_engine, recent_writers
+from api.routers.auth import create_token
+
+settings = get_settings()
+USER_ID = "c603ef4f-08f9-4130-a770-3a34defa44b3"
+
+
+class TestEngine:
+    @pytest.mark.asyncio
+    async def test_pool_limit(self, monkeypatch):
+        monkeypatch.setattr(settings, "db_pool_size", 2)
+        monkeypatch.setattr(settings, "db_max_overflow", 1)
+        monkeypatch.setattr(settings, "db_pool_timeout", 0.1)
+        engine = make_engine(settings.db_url)
+
+        # Once the pool and its overflow are used, the next connection times out
+        connections = [await engine.connect() for _ in range(3)]
+        with pytest.raises(exc.TimeoutError):
+            await engine.connect()
+
+        for connection in connections:
+            await connection.close()
+        await engine.dispose()
+
+    @pytest.mark.asyncio
+    async def test_pgbouncer(self, monkeypatch):
+        monkeypatch.setattr(settings, "db_pgbouncer", True)
+        engine = make_engine(settings.db_url)
+
+        # The statements aren't cached, and have unique names when they're prepared
+        for _ in range(2):
+            async with engine.connect() as connection:
+                assert (await connection.execute(text("SELECT 1"))).scalar() == 1
+                raw_connection = (await connection.get_raw_connection()).connection
+                assert raw_connection._prepared_statement_cache is None
+                assert isinstance(raw_connection._connection, PgBouncerConnection)
+        await engine.dispose()
+
+
+class TestReadReplica:
+    @pytest.mark.asyncio
+    async def test_read_your_writes(self, client: AsyncClient, manga_draft, monkeypatch):
+        # A second engine on the same database stands in for the replica
+        read_engine = make_engine(settings.db_url)
+        statements = []
+        event.listen(read_engine.sync_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        monkeypatch.setattr(db, "read_session", sessionmaker(read_engine, expire_on_commit=False, class_=AsyncSession))
+        monkeypatch.setattr(settings, "response_cache", "memory")
+        monkeypatch.setattr(response_cache, "_backend", MemoryBackend())
+        recent_writers.clear()
+        token = create_token(sub=USER_ID, typ="session", expires_delta=timedelta(minutes=7))
+        headers = {"Authorization": f"Bearer {token}"}
+
+        # Logging in doesn't make a writer, and the anonymous clients, which can share an address, never are
+        form = {"grant_type": "", "client_id": "", "client_secret": "", "username": "admin", "password": "pass"}
+        response = await client.post("/auth/token", data=form)
+        assert response.status_code == status.HTTP_200_OK
+        await client.post("/auth/token", data=form, headers=headers)
+        await client.post("/manga", json=manga_draft)
+        assert len(recent_writers) == 0
+
+        # The catalogue is read from the replica
+        await client.get("/manga", headers=headers)
+        assert statements
+
+        # Until the client writes something, then it reads from the primary for a while
+        await client.post("/manga", json=manga_draft, headers=headers)
+        statements.clear()
+        response = await client.get("/manga", headers=headers)
+        assert "x-cache" not in response.headers
+        await client.get("/autocomplete/groups", headers=headers)
+        assert statements == []
+
+        # The other clients still use the replica, whose responses aren't cached until it caught up with the write
+        await client.get("/manga")
+        assert statements
+        response = await client.get("/manga")
+        assert response.headers["x-cache"] == "MISS"
+
+        # Once the replica caught up, its responses are cached again
+        recent_writers.clear()
+        response_cache.get_backend().values.delete(response_cache.INVALIDATED_KEY)
+        statements.clear()
+        await client.get("/manga", headers=headers)
+        assert statements
+        response = await client.get("/manga", headers=headers)
+        assert response.headers["x-cache"] == "HIT"
+        await read_engine.dispose()
+
+    @pytest.mark.asyncio
+    async def test_single_session(self, client: AsyncClient, create_chapter, monkeypatch):
+        read_engine = make_engine(settings.db_url)
+        monkeypatch.setattr(db, "read_session", sessionmaker(read_engine, expire_on_commit=False, class_=AsyncSession))
+        chapter = await create_chapter(pages=1)
+        recent_writers.clear()
+        statements = []
+
+        def capture(*args):
+            statements.append(args[2])
+
+        event.listen(db.engine.sync_engine, "before_cursor_execute", capture)
+
+        # The chapter or manga whose children are listed is read from the replica too, with the same session
+        response = await client.get(f"/manga/{chapter['mangaId']}/chapters")
+        assert [c["id"] for c in response.json()] == [chapter["id"]]
+        response = await client.get(f"/chapter/{chapter['id']}/comments")
+        assert response.json()["results"] == []
+        event.remove(db.engine.sync_engine, "before_cursor_execute", capture)
+        assert statements == []
+        await read_engine.dispose()
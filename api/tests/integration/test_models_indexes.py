@@ -0,0 +1,69 @@
+import json
+import uuid
+
+import pytest
+from sqlalchemy import event
+
+from api.db import async_session, engine
+from api.models.chapter import Chapter
+from api.models.comment import Comment
+from api.models.upload import UploadedBlob
+
+
+async def query_plans(query):
+    """Runs a query of a model and returns the plans of the statements it executed,
+    without sequential nor bitmap scans, so the indexes are used even with small tables.
+    """
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", capture)
+    try:
+        async with async_session() as db_session:
+            await query(db_session)
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", capture)
+
+    plans = []
+    async with engine.connect() as connection:
+        await connection.exec_driver_sql("SET enable_seqscan = off")
+        await connection.exec_driver_sql("SET enable_bitmapscan = off")
+        for statement, parameters in statements:
+            result = await connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters)
+            plan = result.scalar()
+            plans.append(json.loads(plan)[0]["Plan"] if isinstance(plan, str) else plan[0]["Plan"])
+    return plans
+
+
+def plan_nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+class TestIndexes:
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize(
+        "query, index",
+        [
+            (lambda db_session: Chapter.from_manga(db_session, uuid.uuid4()), "ix_chapter_manga_id_number"),
+            (lambda db_session: Chapter.latest(db_session, 10, 20), "ix_chapter_upload_time_id"),
+            (
+                lambda db_session: Comment.from_chapter(db_session, uuid.uuid4()),
+                "ix_comment_chapter_id_create_time_id",
+            ),
+            (
+                lambda db_session: Chapter.editable(db_session, ["role:uploader", f"user:{uuid.uuid4()}"]),
+                "ix_chapter_owner_id_upload_time_id",
+            ),
+            (lambda db_session: UploadedBlob.from_session(db_session, uuid.uuid4()), "ix_uploadedblob_session_id"),
+        ],
+    )
+    async def test_index_scans(self, query, index):
+        # The page query should be filtered and ordered by the index, without sorting the rows
+        plans = await query_plans(query)
+        page_plan = [node for plan in plans for node in plan_nodes(plan) if node.get("Index Name") == index]
+        assert page_plan, f"{index} isn't used"
+        assert all(node["Node Type"] != "Sort" for plan in plans for node in plan_nodes(plan))
@@ -1,15 +1,38 @@
+from contextlib import contextmanager
 from datetime import timedelta
+from uuid import uuid4
 
 import pytest
 from fastapi import status
 from httpx import AsyncClient
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from api.routers.auth import create_token
+from api.config import get_settings
+from api.db import engine, recent_writers
+from api.routers.auth import create_token, user_cache
+
+settings = get_settings()
 
 USER_ID = "c603ef4f-08f9-4130-a770-3a34defa44b3"
 FAKE_USER_ID = "00000000-08f9-4130-a770-3a34defa44b3"
 
 
+@contextmanager
+def count_user_queries():
+    queries = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("SELECT") and 'FROM "user"' in statement:
+            queries.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", capture)
+    try:
+        yield queries
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", capture)
+
+
 class TestAuth:
     form = {"grant_type": "", "client_id": "", "client_secret": "", "username": "admin", "password": "pass"}
 
@@ -70,6 +93,17 @@ class TestAuth:
 
         await self._validate_token_response(response, client)
 
+    @pytest.mark.asyncio
+    async def test_hash_queue_metric(self, client: AsyncClient):
+        # The passwords are verified in the hashing pool, which reports how long they waited for it
+        await client.post("/auth/token", data=self.form)
+
+        response = await client.get("/metrics")
+        count = next(
+            line for line in response.text.splitlines() if line.startswith("password_hash_queue_seconds_count")
+        )
+        assert float(count.split()[-1]) >= 1
+
     @pytest.mark.asyncio
     async def test_refresh(self, client: AsyncClient):
         response = await client.post("/auth/token", data=self.form)
@@ -78,3 +112,132 @@ class TestAuth:
         response = await client.post("/auth/refresh", json=refresh_body)
 
         await self._validate_token_response(response, client)
+
+    @pytest.mark.asyncio
+    async def test_user_cache(self, client: AsyncClient, headers: dict):
+        name = f"u{uuid4().hex[:12]}"
+        body = {"username": name, "email": None, "password": "password", "role": "uploader"}
+        response = await client.post("/user", json=body, headers=headers)
+        user_id = response.json()["id"]
+        user_headers = {"Authorization": "Bearer " + create_token(sub=user_id, typ="session")}
+
+        # Once authenticated, the user doesn't need to be queried again
+        await client.get("/user/me", headers=user_headers)
+        with count_user_queries() as queries:
+            response = await client.get("/user/me", headers=user_headers)
+        assert response.json()["role"] == "uploader"
+        assert queries == []
+
+        # Editing the user invalidates it
+        response = await client.put(f"/user/{user_id}", json={**body, "role": "user"}, headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        response = await client.get("/user/me", headers=user_headers)
+        assert response.json()["role"] == "user"
+
+        response = await client.delete(f"/user/{user_id}", headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        response = await client.get("/user/me", headers=user_headers)
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    @pytest.mark.asyncio
+    async def test_user_cache_version(self, client: AsyncClient, headers: dict, monkeypatch):
+        monkeypatch.setattr(settings, "jwt_principal_claims", True)
+        name = f"u{uuid4().hex[:12]}"
+        body = {"username": name, "email": None, "password": "password", "role": "uploader"}
+        response = await client.post("/user", json=body, headers=headers)
+        user_id = response.json()["id"]
+        response = await client.post("/auth/token", data={**self.form, "username": name, "password": "password"})
+        user_headers = {"Authorization": "Bearer " + response.json()["access_token"]}
+        await client.get("/user/me", headers=user_headers)
+
+        # Edited by another process, whose invalidation doesn't reach this cache
+        monkeypatch.setattr(user_cache, "delete", lambda key: None)
+        response = await client.put(f"/user/{user_id}", json={**body, "role": "user"}, headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        response = await client.get("/user/me", headers=user_headers)
+        assert response.json()["role"] == "uploader"
+
+        # The new tokens carry the new version, so they skip the stale user, which is replaced for every token
+        response = await client.post("/auth/token", data={**self.form, "username": name, "password": "password"})
+        new_headers = {"Authorization": "Bearer " + response.json()["access_token"]}
+        response = await client.get("/user/me", headers=new_headers)
+        assert response.json()["role"] == "user"
+        with count_user_queries() as queries:
+            response = await client.get("/user/me", headers=user_headers)
+        assert response.json()["role"] == "user"
+        assert queries == []
+
+        monkeypatch.undo()
+        response = await client.delete(f"/user/{user_id}", headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+
+    @pytest.mark.asyncio
+    async def test_principal_claims(self, client: AsyncClient, headers: dict, manga_draft, monkeypatch):
+        monkeypatch.setattr(settings, "jwt_principal_claims", True)
+        name = f"u{uuid4().hex[:12]}"
+        body = {"username": name, "email": None, "password": "password", "role": "uploader"}
+        response = await client.post("/user", json=body, headers=headers)
+        user_id = response.json()["id"]
+        response = await client.post("/auth/token", data={**self.form, "username": name, "password": "password"})
+        user_headers = {"Authorization": "Bearer " + response.json()["access_token"]}
+
+        response = await client.post("/manga", json=manga_draft, headers=headers)
+        response = await client.post("/upload/begin", json={"mangaId": response.json()["id"]}, headers=user_headers)
+        assert response.status_code == status.HTTP_201_CREATED
+        session_id = response.json()["id"]
+
+        # The role is in the token, so the permissions are checked without querying the user
+        user_cache.clear()
+        with count_user_queries() as queries:
+            response = await client.get(f"/upload/{session_id}", headers=user_headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert queries == []
+
+        # Once the user is edited, its token is outdated for the user management, but not for the rest
+        response = await client.put(f"/user/{user_id}", json={**body, "role": "user"}, headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        response = await client.put(f"/user/{user_id}", json=body, headers=user_headers)
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+        response = await client.get(f"/upload/{session_id}", headers=user_headers)
+        assert response.status_code == status.HTTP_200_OK
+
+        # A new token has the new role
+        response = await client.post("/auth/token", data={**self.form, "username": name, "password": "password"})
+        user_headers = {"Authorization": "Bearer " + response.json()["access_token"]}
+        response = await client.get(f"/upload/{session_id}", headers=user_headers)
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+        response = await client.delete(f"/user/{user_id}", headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+
+    @pytest.mark.asyncio
+    async def test_single_user_lookup(self, client: AsyncClient, headers: dict, manga_draft, monkeypatch):
+        # Without the user cache, the stacked auth dependencies still look the user up once per request
+        monkeypatch.setattr(user_cache, "ttl", 0)
+        user_cache.clear()
+        response = await client.post("/manga", json=manga_draft, headers=headers)
+        manga_id = response.json()["id"]
+
+        with count_user_queries() as queries:
+            response = await client.post("/upload/begin", json={"mangaId": manga_id}, headers=headers)
+        assert response.status_code == status.HTTP_201_CREATED
+        assert len(queries) == 1
+
+        # Including the cached routes, whose cache key depends on the user
+        recent_writers.clear()
+        with count_user_queries() as queries:
+            response = await client.get(f"/manga/{manga_id}/chapters", headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert len(queries) == 1
+
+        # Once the user is cached, the cached responses are sent without opening a session
+        monkeypatch.setattr(user_cache, "ttl", 60)
+        response = await client.get(f"/manga/{manga_id}/chapters", headers=headers)
+        sessions = []
+        init_session = AsyncSession.__init__
+        monkeypatch.setattr(
+            AsyncSession, "__init__", lambda *args, **kwargs: sessions.append(args[0]) or init_session(*args, **kwargs)
+        )
+        response = await client.get(f"/manga/{manga_id}/chapters", headers=headers)
+        assert response.headers["x-cache"] == "HIT"
+        assert sessions == []
@@ -1,4 +1,7 @@
+from uuid import uuid4
+
 import pytest
+from fastapi import status
 from httpx import AsyncClient
 
 
@@ -8,3 +11,31 @@ class TestAutocomplete:
         # Return a list with only ["no group"] if no groups have been provided yet
         response = await client.get("/autocomplete/groups", headers=headers)
         assert response.json() == ["no group"]
+
+    @pytest.mark.asyncio
+    async def test_groups_prefix(self, client: AsyncClient, headers: dict):
+        response = await client.get("/autocomplete/groups", params={"prefix": "NO "})
+        assert response.json() == ["no group"]
+        response = await client.get("/autocomplete/groups", params={"prefix": "nope"})
+        assert response.json() == []
+
+    @pytest.mark.asyncio
+    async def test_groups_invalidation(self, client: AsyncClient, headers: dict, create_chapter, chapter_draft):
+        group = f"Group {uuid4()}"
+        await client.get("/autocomplete/groups")
+
+        # The cached groups should follow the chapters being created, edited and deleted
+        chapter = await create_chapter(pages=1, scanGroup=group)
+        response = await client.get("/autocomplete/groups", params={"prefix": group.lower()})
+        assert response.json() == [group]
+
+        body = {**chapter_draft, "scanGroup": f"{group} edited"}
+        response = await client.put(f"/chapter/{chapter['id']}", json=body, headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        response = await client.get("/autocomplete/groups", params={"prefix": group})
+        assert response.json() == [f"{group} edited"]
+
+        response = await client.delete(f"/chapter/{chapter['id']}", headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        response = await client.get("/autocomplete/groups", params={"prefix": group})
+        assert response.json() == []
@@ -0,0 +1,187 @@
+from io import BytesIO
+from os import path
+from zipfile import ZIP_STORED, ZipFile
+
+import pytest
+from fastapi import status
+from httpx import AsyncClient
+
+from api.config import get_settings
+from api.db import async_session
+from api.fastapi_permissions import Authenticated, Everyone, filter_permitted
+from api.media import MediaFileResponse
+from api.models.chapter import Chapter
+
+settings = get_settings()
+
+
+class TestChapterArchive:
+    @pytest.mark.asyncio
+    async def test_get_archive(self, client: AsyncClient, headers: dict, create_chapter):
+        chapter = await create_chapter(pages=3)
+        chapter_path = path.join(settings.media_path, chapter["mangaId"], chapter["id"])
+
+        response = await client.get(f"/chapter/{chapter['id']}/archive")
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["content-type"] == "application/vnd.comicbook+zip"
+        assert (
+            response.headers["content-disposition"]
+            == "attachment; filename*=utf-8''Monochrome%20Lovers%20-%20Chapter.cbz"
+        )
+        assert int(response.headers["content-length"]) == len(response.content)
+
+        # The pages are stored as they are, in order
+        with ZipFile(BytesIO(response.content)) as archive:
+            assert archive.testzip() is None
+            assert archive.namelist() == ["1.jpg", "2.jpg", "3.jpg"]
+            for info in archive.infolist():
+                assert info.compress_type == ZIP_STORED
+                with open(path.join(chapter_path, info.filename), "rb") as file:
+                    assert archive.read(info) == file.read()
+
+        response = await client.get(f"/chapter/{chapter['id']}/archive?format=zip")
+        assert response.headers["content-type"] == "application/zip"
+
+    @pytest.mark.asyncio
+    async def test_get_archive_range(self, client: AsyncClient, headers: dict, create_chapter):
+        chapter = await create_chapter(pages=2)
+        response = await client.get(f"/chapter/{chapter['id']}/archive")
+        content, etag = response.content, response.headers["etag"]
+        size = len(content)
+
+        # A download can be resumed from anywhere in the archive
+        for start, stop in ((0, 10), (20, 500), (500, size - 30), (size - 30, size)):
+            response = await client.get(
+                f"/chapter/{chapter['id']}/archive", headers={"Range": f"bytes={start}-{stop - 1}"}
+            )
+            assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+            assert response.headers["content-range"] == f"bytes {start}-{stop - 1}/{size}"
+            assert response.content == content[start:stop]
+
+        response = await client.get(f"/chapter/{chapter['id']}/archive", headers={"Range": "bytes=-40"})
+        assert response.content == content[-40:]
+        response = await client.get(f"/chapter/{chapter['id']}/archive", headers={"Range": f"bytes={size}-"})
+        assert response.status_code == status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+        assert response.headers["content-range"] == f"bytes */{size}"
+
+        # The range is ignored if the archive changed
+        response = await client.get(
+            f"/chapter/{chapter['id']}/archive", headers={"Range": "bytes=10-", "If-Range": '"other"'}
+        )
+        assert response.status_code == status.HTTP_200_OK and response.content == content
+        response = await client.get(
+            f"/chapter/{chapter['id']}/archive", headers={"Range": "bytes=10-", "If-Range": etag}
+        )
+        assert response.status_code == status.HTTP_206_PARTIAL_CONTENT and response.content == content[10:]
+
+
+class TestEditableChapters:
+    @pytest.mark.asyncio
+    async def test_editable_chapters(self, client: AsyncClient, headers: dict, create_user, create_chapter):
+        _, user_id, user_headers = await create_user("uploader")
+        chapter = await create_chapter(user_headers)
+        admin_chapter = await create_chapter()
+
+        # The uploaders can only edit their own chapters, the admins can edit all of them
+        response = await client.get("/chapter/editable", params={"limit": 50}, headers=user_headers)
+        assert [c["id"] for c in response.json()["results"]] == [chapter["id"]]
+        response = await client.get("/chapter/editable", params={"limit": 2}, headers=headers)
+        assert [c["id"] for c in response.json()["results"]] == [admin_chapter["id"], chapter["id"]]
+        response = await client.get("/chapter/editable")
+        assert response.json()["results"] == []
+
+        # The lists that aren't paginated are filtered the same way in Python
+        principals = [Everyone, Authenticated, f"user:{user_id}", "role:uploader"]
+        async with async_session() as db_session:
+            chapters = [await Chapter.find(db_session, c["id"]) for c in (chapter, admin_chapter)]
+        assert await filter_permitted(principals, "edit", chapters) == chapters[:1]
+        assert await filter_permitted(principals, "view", chapters) == chapters
+
+        response = await client.delete(f"/user/{user_id}", headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+
+
+class TestChapterPages:
+    @pytest.mark.asyncio
+    async def test_get_page(self, client: AsyncClient, headers: dict, create_chapter):
+        chapter = await create_chapter()
+        chapter_path = path.join(settings.media_path, chapter["mangaId"], chapter["id"])
+
+        for page in ("1.jpg", "2.webp", "1.320.jpg"):
+            response = await client.get(f"/chapter/{chapter['id']}/pages/{page}")
+            assert response.status_code == status.HTTP_200_OK
+            with open(path.join(chapter_path, page), "rb") as file:
+                assert response.content == file.read()
+
+        # The pages are versioned with their content, only their current version can be cached forever
+        response = await client.get(f"/chapter/{chapter['id']}")
+        page, version = response.json()["pages"][0].split("?v=")
+        assert page == f"/media/{chapter['mangaId']}/{chapter['id']}/1.jpg"
+        for url in (f"{page}?v={version}", f"/chapter/{chapter['id']}/pages/1.320.webp?v={version}"):
+            response = await client.get(url)
+            assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
+        for other in ("0" * 64, chapter["version"]):
+            response = await client.get(f"/chapter/{chapter['id']}/pages/1.jpg?v={other}")
+            assert response.headers["cache-control"] == "public, no-cache"
+        response = await client.get(
+            f"/chapter/{chapter['id']}/pages/1.jpg", headers={"If-None-Match": response.headers["etag"]}
+        )
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+        # Only the pages of the chapter can be requested
+        for page in ("3.jpg", "0.jpg", "1.123.jpg"):
+            response = await client.get(f"/chapter/{chapter['id']}/pages/{page}")
+            assert response.status_code == status.HTTP_404_NOT_FOUND
+        for page in ("cover.jpg", "1.png", "1.jpg.webp"):
+            response = await client.get(f"/chapter/{chapter['id']}/pages/{page}")
+            assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        response = await client.get(f"/chapter/{chapter['id']}/pages/..%2F..%2Fcover.jpg")
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    @pytest.mark.asyncio
+    async def test_get_page_range(self, client: AsyncClient, create_chapter, monkeypatch):
+        monkeypatch.setattr(MediaFileResponse, "chunk_size", 100)
+        chapter = await create_chapter(pages=1)
+        page_path = path.join(settings.media_path, chapter["mangaId"], chapter["id"], "1.jpg")
+        with open(page_path, "rb") as file:
+            content = file.read()
+        size = len(content)
+
+        for url in (f"/chapter/{chapter['id']}/pages/1.jpg", f"/media/{chapter['mangaId']}/{chapter['id']}/1.jpg"):
+            response = await client.get(url)
+            assert response.headers["accept-ranges"] == "bytes"
+            etag = response.headers["etag"]
+
+            # A single range of the page is sent, over several chunks
+            response = await client.get(url, headers={"Range": "bytes=50-349"})
+            assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+            assert response.content == content[50:350]
+            assert response.headers["content-range"] == f"bytes 50-349/{size}"
+            response = await client.get(url, headers={"Range": "bytes=-40", "If-Range": etag})
+            assert response.status_code == status.HTTP_206_PARTIAL_CONTENT and response.content == content[-40:]
+
+            # Unless it's outside of the page, or the page changed since
+            response = await client.get(url, headers={"Range": f"bytes={size}-"})
+            assert response.status_code == status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+            assert response.headers["content-range"] == f"bytes */{size}"
+            response = await client.get(url, headers={"Range": "bytes=10-", "If-Range": '"other"'})
+            assert response.status_code == status.HTTP_200_OK and response.content == content
+
+    @pytest.mark.asyncio
+    async def test_get_page_proxy(self, client: AsyncClient, headers: dict, create_chapter, monkeypatch):
+        chapter = await create_chapter(pages=1)
+
+        # The reverse proxy sends the file, the API only checks the permissions
+        monkeypatch.setattr(settings, "media_delivery", "x-accel-redirect")
+        response = await client.get(f"/chapter/{chapter['id']}/pages/1.webp")
+        assert response.status_code == status.HTTP_200_OK and response.content == b""
+        assert response.headers["x-accel-redirect"] == f"/internal-media/{chapter['mangaId']}/{chapter['id']}/1.webp"
+
+        monkeypatch.setattr(settings, "media_delivery", "x-sendfile")
+        response = await client.get(f"/chapter/{chapter['id']}/pages/1.webp")
+        assert response.headers["x-sendfile"] == path.join(
+            settings.media_path, chapter["mangaId"], chapter["id"], "1.webp"
+        )
+
+        response = await client.get(f"/chapter/{chapter['id']}/pages/2.webp")
+        assert response.status_code == status.HTTP_404_NOT_FOUND
@@ -0,0 +1,243 @@
+from hashlib import sha256
+from os import path, stat
+from random import randrange
+from uuid import uuid4
+
+import pytest
+from fastapi import status
+from httpx import AsyncClient
+from PIL import Image
+
+from api import response_cache
+from api.config import get_settings
+from api.db import recent_writers
+from api.models.base import total_cache
+from api.models.image import StoredImage
+from api.storage import get_object_path
+
+settings = get_settings()
+
+
+class FakeRedis:
+    """Stores the values like Redis would, without any expiration."""
+
+    def __init__(self, url=None):
+        self.url = url
+        self.values = {}
+
+    @classmethod
+    def from_url(cls, url):
+        return cls(url)
+
+    async def get(self, name):
+        return self.values.get(name)
+
+    async def set(self, name, value, ex=None):
+        self.values[name] = value
+
+    async def incr(self, name):
+        self.values[name] = str(int(self.values.get(name, b"0")) + 1).encode()
+        return int(self.values[name])
+
+
+class TestManga:
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("backend", [None, FakeRedis()])
+    async def test_response_cache(self, client: AsyncClient, headers: dict, monkeypatch, backend, manga_draft):
+        if backend is not None:
+            monkeypatch.setattr(response_cache, "_backend", backend)
+        response = await client.post("/manga", json=manga_draft, headers=headers)
+        manga_id = response.json()["id"]
+
+        response = await client.get(f"/manga/{manga_id}")
+        assert response.headers["x-cache"] == "MISS"
+        response = await client.get(f"/manga/{manga_id}")
+        assert response.headers["x-cache"] == "HIT" and response.json()["title"] == manga_draft["title"]
+
+        # The users with other principals don't share the same responses, once they read their own writes
+        recent_writers.clear()
+        response = await client.get(f"/manga/{manga_id}", headers=headers)
+        assert response.headers["x-cache"] == "MISS"
+        response = await client.get(f"/manga/{manga_id}", headers=headers)
+        assert response.headers["x-cache"] == "HIT"
+
+        # Any edit invalidates the cached responses
+        response = await client.put(f"/manga/{manga_id}", json={**manga_draft, "title": "Edited"}, headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        response = await client.get(f"/manga/{manga_id}")
+        assert response.headers["x-cache"] == "MISS" and response.json()["title"] == "Edited"
+
+        # Errors aren't cached
+        for _ in range(2):
+            response = await client.get(f"/manga/{uuid4()}")
+            assert response.status_code == status.HTTP_404_NOT_FOUND and "x-cache" not in response.headers
+
+    def test_cache_factory(self, monkeypatch):
+        # Any backend can be created by a factory, like the ones of the redis package
+        monkeypatch.setattr(settings, "response_cache", f"{__name__}:FakeRedis.from_url")
+        monkeypatch.setattr(settings, "response_cache_url", "redis://localhost:6379/0")
+        monkeypatch.setattr(response_cache, "_backend", None)
+        backend = response_cache.get_backend()
+        assert isinstance(backend, FakeRedis) and backend.url == "redis://localhost:6379/0"
+
+    @pytest.mark.asyncio
+    async def test_search_cursor(self, client: AsyncClient, headers: dict, manga_draft):
+        title = f"Cursor {uuid4()}"
+        for i in range(5):
+            await client.post("/manga", json={**manga_draft, "title": f"{title} {i}"}, headers=headers)
+        response = await client.get("/manga", params={"title": title, "limit": 5})
+        expected = [m["id"] for m in response.json()["results"]]
+        assert len(expected) == 5
+
+        # Following the cursors should give the same pages as the offsets
+        response = await client.get("/manga", params={"title": title, "limit": 2})
+        pages = [response.json()]
+        while pages[-1]["next"]:
+            response = await client.get("/manga", params={"title": title, "limit": 2, "after": pages[-1]["next"]})
+            assert response.status_code == status.HTTP_200_OK
+            pages.append(response.json())
+        assert [m["id"] for page in pages for m in page["results"]] == expected
+        assert [len(page["results"]) for page in pages] == [2, 2, 1]
+        assert all(page["total"] == 5 for page in pages)
+
+        response = await client.get("/manga", params={"title": title, "limit": 2, "offset": 2})
+        assert [m["id"] for m in response.json()["results"]] == expected[2:4]
+
+        response = await client.get("/manga", params={"title": title, "after": "garbage"})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    @pytest.mark.asyncio
+    async def test_search_ranking(self, client: AsyncClient, headers: dict, manga_draft):
+        word = uuid4().hex
+        ids = {}
+        for field in ("description", "author", "title"):
+            response = await client.post(
+                "/manga", json={**manga_draft, field: f"{manga_draft[field]} {word}"}, headers=headers
+            )
+            ids[field] = response.json()["id"]
+
+        # The title, author, artist and description are searched, the title is ranked first
+        response = await client.get("/manga", params={"title": word})
+        assert [m["id"] for m in response.json()["results"]] == [ids["title"], ids["author"], ids["description"]]
+
+        # The words are matched as prefixes, all of them need to match
+        response = await client.get("/manga", params={"title": f"{word[:10]} monochr"})
+        assert [m["id"] for m in response.json()["results"]] == [ids["title"], ids["author"], ids["description"]]
+        response = await client.get("/manga", params={"title": f"{word[:10]} monochrx"})
+        assert response.json()["results"] == []
+
+    @pytest.mark.asyncio
+    async def test_search_total(self, client: AsyncClient, headers: dict, manga_draft, monkeypatch):
+        monkeypatch.setattr(settings, "response_cache", "none")
+        title = f"Total {uuid4()}"
+        for i in range(3):
+            await client.post("/manga", json={**manga_draft, "title": f"{title} {i}"}, headers=headers)
+
+        # The exact total is counted with the page, even past the last one
+        response = await client.get("/manga", params={"title": title, "limit": 2})
+        assert response.json()["total"] == 3
+        response = await client.get("/manga", params={"title": title, "offset": 5})
+        assert response.json()["total"] == 3 and response.json()["results"] == []
+
+        monkeypatch.setattr(settings, "pagination_total", "none")
+        response = await client.get("/manga", params={"title": title})
+        assert response.json()["total"] is None and len(response.json()["results"]) == 3
+
+        monkeypatch.setattr(settings, "pagination_total", "estimated")
+        response = await client.get("/manga", params={"title": title})
+        assert response.json()["total"] >= 0
+        response = await client.get("/manga")
+        assert response.json()["total"] >= 0
+
+        # The cached total is kept until it expires
+        monkeypatch.setattr(settings, "pagination_total", "cached")
+        response = await client.get("/manga", params={"title": title})
+        assert response.json()["total"] == 3
+        await client.post("/manga", json={**manga_draft, "title": f"{title} 3"}, headers=headers)
+        response = await client.get("/manga", params={"title": title})
+        assert response.json()["total"] == 3
+        total_cache.clear()
+        response = await client.get("/manga", params={"title": title})
+        assert response.json()["total"] == 4
+
+    @pytest.mark.asyncio
+    async def test_cover(self, client: AsyncClient, headers: dict, manga_draft, image_file):
+        response = await client.post("/manga", json=manga_draft, headers=headers)
+        manga_id = response.json()["id"]
+
+        response = await client.put(
+            f"/manga/{manga_id}/cover", files=[image_file("cover.png", 400, 600)], headers=headers
+        )
+        assert response.status_code == status.HTTP_200_OK
+
+        # The cover and its variants should be saved, without being upscaled
+        manga_path = path.join(settings.media_path, manga_id)
+        with Image.open(path.join(manga_path, "cover.jpg")) as im:
+            assert im.size == (400, 600)
+        with Image.open(path.join(manga_path, "cover.320.webp")) as im:
+            assert im.format == "WEBP" and im.size == (320, 480)
+        with Image.open(path.join(manga_path, "cover.720.jpg")) as im:
+            assert im.format == "JPEG" and im.size == (400, 600)
+        # Those wider than the cover aren't encoded again, they're the full size ones
+        assert stat(path.join(manga_path, "cover.720.jpg")).st_ino == stat(path.join(manga_path, "cover.jpg")).st_ino
+        assert (
+            stat(path.join(manga_path, "cover.1440.webp")).st_ino == stat(path.join(manga_path, "cover.webp")).st_ino
+        )
+
+    @pytest.mark.asyncio
+    async def test_cover_caching(self, client: AsyncClient, headers: dict, manga_draft, image_file):
+        response = await client.post("/manga", json=manga_draft, headers=headers)
+        manga_id = response.json()["id"]
+        assert response.json()["cover"] is None
+        response = await client.put(f"/manga/{manga_id}/cover", files=[image_file("cover.png")], headers=headers)
+        cover = response.json()["cover"]
+        assert cover.startswith(f"/media/{manga_id}/cover.jpg?v=")
+
+        # The versioned cover (and its variants) can be cached forever
+        response = await client.get(cover.replace("cover.jpg", "cover.320.webp"))
+        assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
+        response = await client.get(cover)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
+        etag = response.headers["etag"]
+
+        response = await client.get(cover, headers={"If-None-Match": f'"other", W/{etag}'})
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+        # The unversioned one needs to be revalidated, and changes with the cover
+        response = await client.get(f"/media/{manga_id}/cover.jpg", headers={"If-None-Match": etag})
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response.headers["cache-control"] == "public, no-cache"
+
+        response = await client.put(f"/manga/{manga_id}/cover", files=[image_file("cover.png", 50)], headers=headers)
+        assert response.json()["cover"] != cover
+        # The previous version isn't the current one anymore
+        response = await client.get(cover)
+        assert response.headers["cache-control"] == "public, no-cache"
+        response = await client.get(f"/media/{manga_id}/cover.jpg", headers={"If-None-Match": etag})
+        assert response.status_code == status.HTTP_200_OK and response.headers["etag"] != etag
+
+    @pytest.mark.asyncio
+    async def test_delete_releases_images(
+        self, client: AsyncClient, headers: dict, create_chapter, image_file, monkeypatch
+    ):
+        chapter = await create_chapter(pages=1)
+        manga_id = chapter["mangaId"]
+        response = await client.post("/upload/begin", json={"mangaId": manga_id}, headers=headers)
+        session_id = response.json()["id"]
+        color = tuple(randrange(256) for _ in range(3))
+        response = await client.post(
+            f"/upload/{session_id}", files=[image_file("1.png", color=color)], headers=headers
+        )
+        blob_path = path.join(settings.media_path, "blobs", f"{response.json()[0]['id']}.jpg")
+        with open(blob_path, "rb") as file:
+            object_path = get_object_path(sha256(file.read()).hexdigest())
+
+        # The references of the manga's chapters and sessions are released, without counting every reference again
+        async def recount(db_session):
+            raise AssertionError("The refcounts shouldn't be recomputed")
+
+        monkeypatch.setattr(StoredImage, "recount", recount)
+        response = await client.delete(f"/manga/{manga_id}", headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert not path.exists(object_path) and not path.exists(blob_path)
@@ -0,0 +1,283 @@
+from hashlib import sha256
+from io import BytesIO
+from os import path, stat
+from random import randrange
+from typing import Optional
+from zipfile import ZipFile
+
+import pytest
+from fastapi import status
+from httpx import AsyncClient
+from PIL import Image
+from sqlalchemy import event
+
+from api.config import get_settings
+from api.db import engine
+from api.images import run_in_worker
+from api.routers import upload
+from api.storage import get_object_path
+
+settings = get_settings()
+
+
+def zip_file(name: str, members: dict[str, bytes]):
+    content = BytesIO()
+    with ZipFile(content, "w") as archive:
+        for member, data in members.items():
+            archive.writestr(member, data)
+    return "payload", (name, content.getvalue(), "application/zip")
+
+
+@pytest.fixture
+def begin_session(client: AsyncClient, headers: dict, manga_draft: dict):
+    async def begin(owner_headers: Optional[dict] = None, **kwargs):
+        owner_headers = owner_headers or headers
+        response = await client.post("/manga", json=manga_draft, headers=owner_headers)
+        assert response.status_code == status.HTTP_201_CREATED
+        manga_id = response.json()["id"]
+
+        response = await client.post("/upload/begin", json={"mangaId": manga_id, **kwargs}, headers=owner_headers)
+        assert response.status_code == status.HTTP_201_CREATED
+        return response.json()
+
+    return begin
+
+
+class TestUpload:
+    @pytest.mark.asyncio
+    async def test_get_sessions(self, client: AsyncClient, headers: dict, begin_session, create_user, monkeypatch):
+        _, user_id, user_headers = await create_user("uploader")
+        session = await begin_session(user_headers)
+        admin_session = await begin_session()
+        next_session = await begin_session(user_headers)
+
+        # The uploaders can only see their own sessions, in the order they were created
+        response = await client.get("/upload", headers=user_headers)
+        assert response.json()["total"] == 2
+        assert [s["id"] for s in response.json()["results"]] == [session["id"], next_session["id"]]
+
+        # The owned sessions are selected with an IN clause, whose total can be cached too
+        monkeypatch.setattr(settings, "pagination_total", "cached")
+        for _ in range(2):
+            response = await client.get("/upload", headers=user_headers)
+            assert response.json()["total"] == 2
+
+        response = await client.get("/upload", params={"limit": 50}, headers=headers)
+        session_ids = [s["id"] for s in response.json()["results"]]
+        assert session["id"] in session_ids and admin_session["id"] in session_ids
+
+        response = await client.delete(f"/user/{user_id}", headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+
+    @pytest.mark.asyncio
+    async def test_upload_pages(self, client: AsyncClient, headers: dict, begin_session, image_file, chapter_draft):
+        session = await begin_session()
+
+        # Upload some images, they should be converted to JPEG blobs
+        files = [image_file("1.png"), image_file("2.webp", fmt="WEBP")]
+        response = await client.post(f"/upload/{session['id']}", files=files, headers=headers)
+        assert response.status_code == status.HTTP_201_CREATED
+
+        blobs = response.json()
+        assert [b["name"] for b in blobs] == ["1.png", "2.webp"]
+        for blob in blobs:
+            with Image.open(path.join(settings.media_path, "blobs", f"{blob['id']}.jpg")) as im:
+                assert im.format == "JPEG"
+
+        # Commit them as a new chapter
+        body = {"chapterDraft": chapter_draft, "pageOrder": [b["id"] for b in reversed(blobs)]}
+        response = await client.post(f"/upload/{session['id']}/commit", json=body, headers=headers)
+        assert response.status_code == status.HTTP_201_CREATED
+
+        chapter = response.json()
+        chapter_path = path.join(settings.media_path, chapter["mangaId"], chapter["id"])
+        assert chapter["length"] == 2
+        assert path.isfile(path.join(chapter_path, "1.jpg")) and path.isfile(path.join(chapter_path, "2.jpg"))
+        for suffix in (".webp", ".320.jpg", ".720.webp"):
+            assert path.isfile(path.join(chapter_path, f"1{suffix}"))
+
+        # Editing the chapter should give a session with its current pages
+        body = {"mangaId": chapter["mangaId"], "chapterId": chapter["id"]}
+        response = await client.post("/upload/begin", json=body, headers=headers)
+        assert response.status_code == status.HTTP_201_CREATED
+        assert sorted(b["name"] for b in response.json()["blobs"]) == ["1.jpg", "2.jpg"]
+        for blob in response.json()["blobs"]:
+            # The pages aren't copied, the blobs are linked to them
+            blob_stat = stat(path.join(settings.media_path, "blobs", f"{blob['id']}.jpg"))
+            assert blob_stat.st_ino == stat(path.join(chapter_path, blob["name"])).st_ino
+
+        # Reordering the pages should only move the existing files around
+        inodes = {b["name"]: stat(path.join(chapter_path, b["name"])).st_ino for b in response.json()["blobs"]}
+        edit_blobs = sorted(response.json()["blobs"], key=lambda b: b["name"], reverse=True)
+        body = {"chapterDraft": chapter_draft, "pageOrder": [b["id"] for b in edit_blobs]}
+        response = await client.post(f"/upload/{response.json()['id']}/commit", json=body, headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert stat(path.join(chapter_path, "1.jpg")).st_ino == inodes["2.jpg"]
+        assert stat(path.join(chapter_path, "2.jpg")).st_ino == inodes["1.jpg"]
+
+    @pytest.mark.asyncio
+    async def test_convert_together(self, client: AsyncClient, headers: dict, begin_session, image_file, monkeypatch):
+        running, peak = [], []
+
+        async def counting_worker(func, *args):
+            running.append(func)
+            peak.append(len(running))
+            try:
+                return await run_in_worker(func, *args)
+            finally:
+                running.remove(func)
+
+        monkeypatch.setattr(upload, "run_in_worker", counting_worker)
+        session = await begin_session()
+
+        # The images are all written before being converted at the same time, even the ones with the same name
+        files = [image_file("1.png", color="#000001"), image_file("1.png", color="#000002"), image_file("2.png")]
+        members = {"3.png": image_file("3.png")[1][1]}
+        statements = []
+
+        def capture(*args):
+            statements.append(args[2])
+
+        event.listen(engine.sync_engine, "before_cursor_execute", capture)
+        response = await client.post(
+            f"/upload/{session['id']}", files=[*files, zip_file("ch.zip", members)], headers=headers
+        )
+        event.remove(engine.sync_engine, "before_cursor_execute", capture)
+        assert response.status_code == status.HTTP_201_CREATED
+        assert [b["name"] for b in response.json()] == ["1.png", "1.png", "2.png", "3.png"]
+        # With a single INSERT for all of the blobs
+        assert len([s for s in statements if s.startswith("INSERT INTO uploadedblob")]) == 1
+        blob_paths = [path.join(settings.media_path, "blobs", f"{b['id']}.jpg") for b in response.json()]
+        assert len({stat(blob_path).st_ino for blob_path in blob_paths[:3]}) == 3
+        assert max(peak) == 3
+
+    @pytest.mark.asyncio
+    async def test_variants_failure(
+        self, client: AsyncClient, headers: dict, begin_session, image_file, chapter_draft, monkeypatch
+    ):
+        async def failing_worker(func, *args):
+            if func is upload.save_variants:
+                raise OSError("encoder not available")
+            return await run_in_worker(func, *args)
+
+        monkeypatch.setattr(upload, "run_in_worker", failing_worker)
+        session = await begin_session()
+        color = tuple(randrange(256) for _ in range(3))
+        response = await client.post(
+            f"/upload/{session['id']}", files=[image_file("1.png", color=color)], headers=headers
+        )
+
+        # The pages are still linked in the chapter, only the variants are missing
+        body = {"chapterDraft": chapter_draft, "pageOrder": [b["id"] for b in response.json()]}
+        response = await client.post(f"/upload/{session['id']}/commit", json=body, headers=headers)
+        assert response.status_code == status.HTTP_201_CREATED
+        chapter = response.json()
+        chapter_path = path.join(settings.media_path, chapter["mangaId"], chapter["id"])
+        assert path.isfile(path.join(chapter_path, "1.jpg"))
+        assert not path.exists(path.join(chapter_path, "1.webp"))
+
+    @pytest.mark.asyncio
+    async def test_upload_zip(self, client: AsyncClient, headers: dict, begin_session, image_file):
+        session = await begin_session()
+
+        page = image_file("page.png")[1][1]
+        members = {"chapter/1.png": page, "chapter/2.png": page, "chapter/notes.txt": b"", "__MACOSX/._1.png": b""}
+        response = await client.post(f"/upload/{session['id']}", files=[zip_file("ch.zip", members)], headers=headers)
+        assert response.status_code == status.HTTP_201_CREATED
+
+        # Only the images should be extracted, flattened and converted
+        blobs = response.json()
+        assert sorted(b["name"] for b in blobs) == ["1.png", "2.png"]
+        for blob in blobs:
+            assert path.isfile(path.join(settings.media_path, "blobs", f"{blob['id']}.jpg"))
+
+    @pytest.mark.asyncio
+    async def test_deduplicate_pages(self, client: AsyncClient, headers: dict, begin_session, image_file):
+        session = await begin_session()
+
+        # Identical pages should only be stored once
+        files = [image_file("1.png", color="#123456"), image_file("2.png", color="#123456")]
+        response = await client.post(f"/upload/{session['id']}", files=files, headers=headers)
+        blob_paths = [path.join(settings.media_path, "blobs", f"{b['id']}.jpg") for b in response.json()]
+        assert stat(blob_paths[0]).st_ino == stat(blob_paths[1]).st_ino
+        assert stat(blob_paths[0]).st_nlink == 3
+
+        # Once nothing references them, they should be removed
+        with open(blob_paths[0], "rb") as file:
+            object_path = get_object_path(sha256(file.read()).hexdigest())
+        response = await client.delete(f"/upload/{session['id']}", headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert not path.exists(object_path)
+
+    @pytest.mark.asyncio
+    async def test_collect_while_uploading(
+        self, client: AsyncClient, headers: dict, begin_session, image_file, monkeypatch
+    ):
+        session = await begin_session()
+        files = [image_file("1.png", color=tuple(randrange(256) for _ in range(3)))]
+        response = await client.post(f"/upload/{session['id']}", files=files, headers=headers)
+        blob_id = response.json()[0]["id"]
+        with open(path.join(settings.media_path, "blobs", f"{blob_id}.jpg"), "rb") as file:
+            object_path = get_object_path(sha256(file.read()).hexdigest())
+
+        # The image is collected by another request after it's uploaded again, but before it's acquired
+        acquire = upload.StoredImage.acquire
+
+        async def acquire_after_collect(db_session, digests):
+            await upload.release_images(db_session, digests)
+            assert not path.exists(object_path)
+            await acquire(db_session, digests)
+
+        monkeypatch.setattr(upload.StoredImage, "acquire", acquire_after_collect)
+        response = await client.post(f"/upload/{session['id']}", files=files, headers=headers)
+        monkeypatch.undo()
+        assert response.status_code == status.HTTP_201_CREATED
+        assert path.exists(object_path)
+        assert path.exists(path.join(settings.media_path, "blobs", f"{response.json()[0]['id']}.jpg"))
+
+    @pytest.mark.asyncio
+    async def test_delete_pages(self, client: AsyncClient, headers: dict, begin_session, image_file):
+        session = await begin_session()
+
+        files = [image_file("1.png"), image_file("2.png"), image_file("3.png")]
+        response = await client.post(f"/upload/{session['id']}", files=files, headers=headers)
+        blob_ids = [b["id"] for b in response.json()]
+
+        # Delete a single page
+        response = await client.delete(f"/upload/{session['id']}/{blob_ids[0]}", headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        response = await client.get(f"/upload/{session['id']}", headers=headers)
+        assert sorted(b["id"] for b in response.json()["blobs"]) == sorted(blob_ids[1:])
+
+        # Delete the rest of them
+        response = await client.delete(f"/upload/{session['id']}/files", headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        response = await client.get(f"/upload/{session['id']}", headers=headers)
+        assert response.json()["blobs"] == []
+        for blob_id in blob_ids:
+            assert not path.exists(path.join(settings.media_path, "blobs", f"{blob_id}.jpg"))
+
+    @pytest.mark.asyncio
+    async def test_slice_pages(self, client: AsyncClient, headers: dict, begin_session, image_file):
+        session = await begin_session()
+
+        files = [image_file("1.png", height=300), image_file("2.png", height=250)]
+        response = await client.post(f"/upload/{session['id']}", files=files, headers=headers)
+        blob_ids = [b["id"] for b in response.json()]
+
+        # 550px of height with 100px of width should be cut in 3 parts
+        response = await client.post(f"/upload/{session['id']}/slice", json=blob_ids, headers=headers)
+        assert response.status_code == status.HTTP_201_CREATED
+        assert sorted(b["name"] for b in response.json()) == ["slice_1.jpg", "slice_2.jpg", "slice_3.jpg"]
+
+    @pytest.mark.asyncio
+    async def test_slice_different_widths(self, client: AsyncClient, headers: dict, begin_session, image_file):
+        session = await begin_session()
+
+        files = [image_file("1.png", width=100), image_file("2.png", width=120)]
+        response = await client.post(f"/upload/{session['id']}", files=files, headers=headers)
+        blob_ids = [b["id"] for b in response.json()]
+
+        # Images with different widths can't be joined
+        response = await client.post(f"/upload/{session['id']}/slice", json=blob_ids, headers=headers)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
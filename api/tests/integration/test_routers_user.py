@@ -0,0 +1,70 @@
+from hashlib import sha256
+from os import path
+from random import randrange
+
+import pytest
+from fastapi import status
+from httpx import AsyncClient
+
+from api.config import get_settings
+from api.passwords import pwd_context
+from api.storage import get_object_path
+
+settings = get_settings()
+
+FORM = {"grant_type": "", "client_id": "", "client_secret": ""}
+
+
+class TestUser:
+    async def _login(self, client: AsyncClient, username: str, password: str):
+        response = await client.post("/auth/token", data={**FORM, "username": username, "password": password})
+        return response.status_code
+
+    @pytest.mark.asyncio
+    async def test_update_password(self, client: AsyncClient, headers: dict, create_user, monkeypatch):
+        body, user_id, _ = await create_user()
+        hashes = []
+        hash_password = pwd_context.hash
+        monkeypatch.setattr(pwd_context, "hash", lambda password: hashes.append(password) or hash_password(password))
+
+        # Without a password, or with the current one, the user is edited without hashing it again
+        response = await client.put(
+            f"/user/{user_id}", json={**body, "password": None, "role": "uploader"}, headers=headers
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["role"] == "uploader"
+        response = await client.put(f"/user/{user_id}", json=body, headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert hashes == []
+        monkeypatch.undo()
+        assert await self._login(client, body["username"], "password") == status.HTTP_200_OK
+
+        # A new password replaces the previous one
+        response = await client.put(f"/user/{user_id}", json={**body, "password": "new password"}, headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert await self._login(client, body["username"], "password") == status.HTTP_401_UNAUTHORIZED
+        assert await self._login(client, body["username"], "new password") == status.HTTP_200_OK
+
+        response = await client.delete(f"/user/{user_id}", headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+
+    @pytest.mark.asyncio
+    async def test_delete_releases_images(
+        self, client: AsyncClient, headers: dict, create_user, manga_draft, image_file
+    ):
+        _, user_id, user_headers = await create_user("uploader")
+        response = await client.post("/manga", json=manga_draft, headers=headers)
+        response = await client.post("/upload/begin", json={"mangaId": response.json()["id"]}, headers=user_headers)
+        session_id = response.json()["id"]
+        color = tuple(randrange(256) for _ in range(3))
+        response = await client.post(
+            f"/upload/{session_id}", files=[image_file("1.png", color=color)], headers=headers
+        )
+        blob_path = path.join(settings.media_path, "blobs", f"{response.json()[0]['id']}.jpg")
+        with open(blob_path, "rb") as file:
+            object_path = get_object_path(sha256(file.read()).hexdigest())
+
+        # The upload sessions of the user are deleted with it, their images too when nothing else references them
+        response = await client.delete(f"/user/{user_id}", headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert not path.exists(object_path) and not path.exists(blob_path)
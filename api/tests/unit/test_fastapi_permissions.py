@@ -0,0 +1,94 @@
+from itertools import product
+from uuid import UUID, uuid4
+
+import pytest
+
+from api.fastapi_permissions import All, Allow, Authenticated, CompiledACL, Deny, Everyone, RowACL
+from api.models.chapter import Chapter
+from api.models.manga import Manga
+
+OWNER = f"user:{uuid4()}"
+
+PRINCIPALS = [
+    [Everyone],
+    [Everyone, Authenticated, f"user:{uuid4()}", "role:user"],
+    [Everyone, Authenticated, f"user:{uuid4()}", "role:uploader"],
+    [Everyone, Authenticated, OWNER, "role:uploader"],
+    [Everyone, Authenticated, f"user:{uuid4()}", "role:admin"],
+]
+
+ACL = (
+    (Allow, [Everyone], "view"),
+    (Deny, ["role:user"], "edit"),
+    (Allow, [Authenticated], {"edit", "comment"}),
+    (Allow, ["role:uploader", OWNER], "delete"),
+    (Allow, ["role:admin"], All),
+)
+
+
+def linear_has_permission(user_principals: list, requested_permission: str, acl):
+    """Evaluation of an ACL before it was compiled, used as a reference"""
+    for action, principals, permissions in acl:
+        if isinstance(permissions, str):
+            permissions = {permissions}
+        if requested_permission in permissions:
+            if all(principal in user_principals for principal in principals):
+                return action == Allow
+    return False
+
+
+class TestCompiledACL:
+    @pytest.mark.parametrize("principals, permission", product(PRINCIPALS, ["view", "edit", "comment", "delete", "x"]))
+    def test_same_result(self, principals, permission):
+        # The first matching entry wins, like with the linear evaluation
+        expected = linear_has_permission(principals, permission, ACL)
+        assert bool(CompiledACL(ACL).check(frozenset(principals), permission)) == expected
+
+        row_acl = RowACL(CompiledACL(ACL[:2]), lambda: ACL[2:])
+        assert bool(row_acl.check(frozenset(principals), permission)) == expected
+        assert tuple(row_acl) == ACL
+
+    def test_lazy_row_entries(self):
+        rows = []
+        manga = Manga(owner_id=OWNER[5:])
+        manga.__row_acl__ = lambda: rows.append(manga) or Manga.__row_acl__(manga)
+
+        # The class ACL is enough to allow anyone to view it
+        assert manga.__acl__.check(frozenset(PRINCIPALS[0]), "view")
+        assert rows == []
+
+        # Only its owner can edit it
+        assert manga.__acl__.check(frozenset(PRINCIPALS[3]), "edit")
+        assert not manga.__acl__.check(frozenset(PRINCIPALS[2]), "edit")
+        assert len(rows) == 2
+
+    def test_single_scan(self):
+        # The entries are scanned once per permission, the next checks only use the index
+        scans = []
+
+        class ScannedEntries(list):
+            def __iter__(self):
+                scans.append(self)
+                return super().__iter__()
+
+        acl = CompiledACL(ACL)
+        acl.entries = ScannedEntries(acl.entries)
+        permissions = ["view", "edit", "comment", "delete", "x"]
+        for _ in range(10):
+            for principals, permission in product(PRINCIPALS, permissions):
+                acl.check(frozenset(principals), permission)
+        assert len(scans) == len(permissions)
+
+
+class TestPermittedClause:
+    def test_owner_acl(self, monkeypatch):
+        # The rows aren't instantiated, the owner ACL of the model is evaluated for each user id
+        monkeypatch.setattr(Chapter, "__row_acl__", lambda self: pytest.fail("a row was instantiated"))
+        owner_id = PRINCIPALS[3][2][5:]
+        clause = Chapter.permitted_clause(PRINCIPALS[3], "edit")
+        assert clause.compile().params == {"owner_id_1": [UUID(owner_id)]}
+
+        # Unless the class ACL decides for all the rows
+        assert str(Chapter.permitted_clause(PRINCIPALS[1], "edit")) == "false"
+        assert str(Chapter.permitted_clause(PRINCIPALS[4], "edit")) == "true"
+        assert str(Chapter.permitted_clause(PRINCIPALS[0], "view")) == "true"
@@ -12,7 +12,17 @@ class TestPaginationResponse(BaseModelTest):
         "limit": settings.max_page_limit,
         "results": [],
         "total": 10,
+        "next": None,
     }
+    correct_data = [
+        {
+            "offset": 0,
+            "limit": settings.max_page_limit,
+            "results": [],
+            "total": 10,
+            "next": "MjAyMS0wMS0wMVQwMDowMDowMCswMDowMHwxYmI1MTM3Mi0yMDMzLTQ4NDEtYjdlNy1kMzkxMjY5YTU5NWQ=",
+        },
+    ]
     wrong_data = [
         # Missing fields
         {
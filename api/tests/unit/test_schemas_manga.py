@@ -96,6 +96,8 @@ class TestMangaResponse(BaseModelTest):
         "id": UUID("1e01d7f6-c4e1-4102-9dd0-a6fccc065978"),
         "create_time": datetime(2000, 8, 24),
         "owner_id": UUID("3f01d7dd-c4e1-4102-9dd0-a6fccc065978"),
+        # This manga has no cover image
+        "cover": None,
     }
     wrong_data = [
         # Missing fields
@@ -98,6 +98,31 @@ class TestUserSchema(BaseModelTest):
     ]
 
 
+class TestUserUpdateSchema(BaseModelTest):
+    schema = sch.UserUpdateSchema
+    parent = TestUser
+    example_data = {
+        **parent.example_data,
+        "password": "password",
+        "role": "uploader",
+    }
+    correct_data = [
+        # The password is optional
+        {
+            "password": None,
+            "role": "uploader",
+        }
+    ]
+    wrong_data = [
+        # Missing fields
+        {},
+        # Value not in enum
+        {
+            "role": "RandomRoleThatDoesntExist",
+        },
+    ]
+
+
 class TestUserResponse(BaseModelTest):
     schema = sch.UserResponse
     parent = TestUser